@@ -7,9 +7,7 @@ echo Installing python requirements
 python -m pip install -r requirements.txt
 echo Initializing Django
 python manage.py migrate
-python manage.py loaddata data/users.json
-python manage.py loaddata data/polls-v4.json
-python manage.py loaddata data/votes-v4.json
+python manage.py load_polls_data data/users.json data/polls-v4.json data/votes-v4.json
 echo "Initializing environment"
 python -c "from django.core.management.utils import get_random_secret_key; f = open('.env', 'w'); f.write('SECRET_KEY=django-insecure-'+get_random_secret_key()+'\n'); f.close()"
 echo "DEBUG=False" >> .env
@@ -3,6 +3,10 @@ ASGI config for mysite project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (for example ``uvicorn mysite.asgi:application``)
+to keep the live results streams at /polls/<id>/result/stream/ open; under
+WSGI they fall back to one snapshot per reconnect.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from decouple import config, Csv
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +61,119 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Cache shared by the views: locmem (one per process), file (shared by
+# the processes of one host), redis or memcached. CACHE_LOCATION is the
+# directory or server address, each backend has a local default.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'polls'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache',
+             str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache',
+              'redis://127.0.0.1:6379'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache',
+                  '127.0.0.1:11211'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        # An empty CACHE_LOCATION, as in sample.env, keeps the default.
+        'LOCATION': (config('CACHE_LOCATION', default='')
+                     or CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='mysite'),
+    }
+}
+
+# Where sessions are stored: db, cached_db (the default cache in front
+# of the database), cache or signed_cookies (in the browser, no query).
+SESSION_STRATEGY = config('SESSION_STRATEGY', default='db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_STRATEGY}'
+
+# Where messages wait for the next page: fallback (a cookie, or the
+# session when they outgrow it), cookie or session.
+MESSAGE_STRATEGY = config('MESSAGE_STRATEGY', default='fallback')
+MESSAGE_STORAGE = {
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+}[MESSAGE_STRATEGY]
+
+# Number of polls on each page of the index.
+POLLS_PAGE_SIZE = config('POLLS_PAGE_SIZE', default=10, cast=int)
+
+# How votes are written: "sync" saves each vote in the request,
+# "buffered" queues them for a background flusher (see polls/ingest.py).
+POLLS_VOTE_INGEST = config('POLLS_VOTE_INGEST', default='sync')
+# Most votes the buffer holds before votes are written synchronously.
+POLLS_VOTE_BUFFER_SIZE = config(
+    'POLLS_VOTE_BUFFER_SIZE', default=10000, cast=int)
+# Longest a buffered vote waits before it is written, in milliseconds.
+POLLS_VOTE_MAX_STALENESS = config(
+    'POLLS_VOTE_MAX_STALENESS', default=500, cast=int)
+# Write the buffer as soon as this many votes are queued.
+POLLS_VOTE_FLUSH_BATCH = config(
+    'POLLS_VOTE_FLUSH_BATCH', default=500, cast=int)
+
+# Seconds the results table of an open poll stays cached.
+# The cache key changes with every vote, closed polls are kept forever.
+POLLS_RESULTS_CACHE_TIMEOUT = config(
+    'POLLS_RESULTS_CACHE_TIMEOUT', default=300, cast=int)
+
+# Token buckets of the vote endpoint: votes per second refilled, and
+# the burst allowed, per logged in user and per client address.
+# A rate of 0 turns the bucket off. The address bucket is off by
+# default, as a whole classroom may vote from behind one NAT address.
+POLLS_VOTE_USER_RATE = config('POLLS_VOTE_USER_RATE', default=0.5, cast=float)
+POLLS_VOTE_USER_BURST = config('POLLS_VOTE_USER_BURST', default=5, cast=int)
+POLLS_VOTE_IP_RATE = config('POLLS_VOTE_IP_RATE', default=0.0, cast=float)
+POLLS_VOTE_IP_BURST = config('POLLS_VOTE_IP_BURST', default=200, cast=int)
+# Number of proxies in front of the app adding to X-Forwarded-For.
+# 0: the address of a bucket is REMOTE_ADDR, the header is ignored.
+POLLS_TRUSTED_PROXIES = config('POLLS_TRUSTED_PROXIES', default=0, cast=int)
+
+# Votes in progress per process above which new ones get 503 (0: no limit).
+POLLS_VOTE_MAX_IN_FLIGHT = config(
+    'POLLS_VOTE_MAX_IN_FLIGHT', default=32, cast=int)
+
+# Send the database, template and total time of each request in a
+# Server-Timing header, shown by the network tab of the browsers.
+POLLS_SERVER_TIMING = config('POLLS_SERVER_TIMING', default=True, cast=bool)
+
+# Directory where each worker process writes its request metrics, for
+# /metrics to add them up. Empty: /metrics shows the serving process only.
+POLLS_METRICS_DIR = config('POLLS_METRICS_DIR', default='')
+# Seconds between two writes of the metrics of a process.
+POLLS_METRICS_FLUSH_INTERVAL = config(
+    'POLLS_METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# Log the SQL queries taking at least this many milliseconds to
+# slow_queries.log (0: off), with the SQLite query plan, writing at most
+# POLLS_SLOW_QUERY_LOG_LIMIT entries per minute and process.
+POLLS_SLOW_QUERY_MS = config('POLLS_SLOW_QUERY_MS', default=0, cast=float)
+POLLS_SLOW_QUERY_EXPLAIN = config(
+    'POLLS_SLOW_QUERY_EXPLAIN', default=True, cast=bool)
+POLLS_SLOW_QUERY_LOG_LIMIT = config(
+    'POLLS_SLOW_QUERY_LOG_LIMIT', default=60, cast=int)
+
+# Seconds a question and its choices stay cached. Edits drop them.
+POLLS_METADATA_CACHE_TIMEOUT = config(
+    'POLLS_METADATA_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Seconds the map of the polls a user voted in stays cached.
+# Every vote of the user drops it.
+POLLS_VOTED_CACHE_TIMEOUT = config(
+    'POLLS_VOTED_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Mark the polls the user voted in on the index.
+POLLS_VOTED_BADGE = config('POLLS_VOTED_BADGE', default=True, cast=bool)
+
+# Seconds between two checks of a poll watched on the live results page.
+POLLS_LIVE_INTERVAL = config('POLLS_LIVE_INTERVAL', default=1.0, cast=float)
+
+# Route the polls pages to their async versions (polls/async_views.py)
+# when serving through mysite.asgi.
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', default=False, cast=bool)
+
 LOGIN_REDIRECT_URL = 'polls:index'  # after login, show list of polls
 LOGOUT_REDIRECT_URL = 'polls:index'       # after logout, return to login page
 
@@ -93,6 +209,83 @@ DATABASES = {
     }
 }
 
+# PRAGMAs run on every new SQLite connection (see polls/sqlite.py).
+SQLITE_PRAGMAS = {}
+
+# "production" tunes SQLite for concurrent votes: WAL journaling,
+# persistent connections, a busy timeout instead of "database is locked"
+# errors, and BEGIN IMMEDIATE so a write transaction takes the write
+# lock up front instead of failing to upgrade it halfway.
+DB_PROFILE = config('DB_PROFILE', default='development')
+
+if DB_PROFILE == 'production':
+    SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=600, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # A file, so that concurrent test connections really share it,
+        # named after the process so that two test runs never share it.
+        'TEST': {'NAME': Path(tempfile.gettempdir())
+                 / f'mysite_test_{os.getpid()}.sqlite3'},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': SQLITE_BUSY_TIMEOUT,
+        'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),
+        # Negative values are in KiB.
+        'cache_size': config('SQLITE_CACHE_SIZE', default=-65536, cast=int),
+    }
+
+# Read replicas of the default database, as a comma-separated list of
+# SQLite files kept up to date with "python manage.py sync_replicas".
+# Reads of the polls app go to them (see polls/routers.py).
+POLLS_REPLICA_DATABASES = []
+for _n, _name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv())):
+    POLLS_REPLICA_DATABASES.append(f'replica{_n}')
+    DATABASES[f'replica{_n}'] = {
+        **DATABASES['default'],
+        'NAME': _name,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Seconds a client keeps reading from the primary after it wrote.
+POLLS_REPLICA_PIN_SECONDS = config(
+    'POLLS_REPLICA_PIN_SECONDS', default=10, cast=int)
+
+if POLLS_REPLICA_DATABASES:
+    DATABASE_ROUTERS = ['polls.routers.ReplicaRouter']
+    MIDDLEWARE.append('polls.middleware.ReplicaPinMiddleware')
+
+
+# Hasher of new passwords and of the passwords rehashed at login:
+# pbkdf2 or scrypt. The cost settings are 0 for Django's default. Compare
+# them with ``python manage.py bench_login``.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = config(
+    'PASSWORD_PBKDF2_ITERATIONS', default=0, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config(
+    'PASSWORD_SCRYPT_WORK_FACTOR', default=0, cast=int)
+PASSWORD_SCRYPT_BLOCK_SIZE = config(
+    'PASSWORD_SCRYPT_BLOCK_SIZE', default=0, cast=int)
+PASSWORD_SCRYPT_PARALLELISM = config(
+    'PASSWORD_SCRYPT_PARALLELISM', default=0, cast=int)
+
+_tuned_hashers = {
+    'pbkdf2': 'polls.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'polls.hashers.TunedScryptPasswordHasher',
+}
+# The first hasher makes the hashes, all of them verify existing ones.
+PASSWORD_HASHERS = [_tuned_hashers.pop(PASSWORD_HASHER)] + [
+    *_tuned_hashers.values(),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -130,11 +323,53 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# How static files are stored: plain, or manifest for hashed names
+# and precompressed variants, served with immutable caching by the app. Run ``python manage.py
+# collectstatic`` after every change of the static files with manifest.
+STATIC_ASSETS = config('STATIC_ASSETS', default='plain')
+
+if STATIC_ASSETS == 'manifest':
+    STORAGES = {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        },
+        'staticfiles': {
+            'BACKEND': 'polls.storage.CompressedManifestStaticFilesStorage',
+        },
+    }
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+        'polls.middleware.PrecompressedStaticMiddleware')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Log file rotation: 'size' starts a new file every LOG_MAX_BYTES,
+# 'time' at every LOG_ROTATE_WHEN (see TimedRotatingFileHandler).
+LOG_ROTATION = config('LOG_ROTATION', default='size')
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+LOG_ROTATE_WHEN = config('LOG_ROTATE_WHEN', default='midnight')
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)
+
+# Fraction of the per-vote info logs that are written, 0 to 1.
+POLLS_VOTE_LOG_SAMPLE_RATE = config(
+    'POLLS_VOTE_LOG_SAMPLE_RATE', default=1.0, cast=float)
+
+if LOG_ROTATION == 'time':
+    _log_file = {
+        'class': 'logging.handlers.TimedRotatingFileHandler',
+        'when': LOG_ROTATE_WHEN,
+    }
+else:
+    _log_file = {
+        'class': 'logging.handlers.RotatingFileHandler',
+        'maxBytes': LOG_MAX_BYTES,
+    }
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -148,11 +383,19 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'vote_sample': {
+            '()': 'polls.log.SampleFilter',
+            'rate': POLLS_VOTE_LOG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'file': {
+            **_log_file,
             'level': 'INFO',
-            'class': 'logging.FileHandler',
             'filename': 'polls.log',
+            'backupCount': LOG_BACKUP_COUNT,
+            'delay': True,
             'formatter': 'details',
         },
         'console': {
@@ -160,12 +403,38 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        'slow_queries_file': {
+            **_log_file,
+            'level': 'INFO',
+            'filename': 'slow_queries.log',
+            'backupCount': LOG_BACKUP_COUNT,
+            'delay': True,
+            'formatter': 'details',
+        },
+        # Hands the records to a thread writing them to the handlers above.
+        'queue': {
+            '()': 'polls.log.QueueListenerHandler',
+            'handlers': ['file', 'console'],
+        },
+        'slow_queries_queue': {
+            '()': 'polls.log.QueueListenerHandler',
+            'handlers': ['slow_queries_file'],
+        },
     },
     'loggers': {
         'polls': {
-            'handlers': ['file', 'console'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': True,
         },
+        'polls.votes': {
+            'filters': ['vote_sample'],
+        },
+        # Kept out of polls.log, see polls.slowlog.
+        'polls.slow_queries': {
+            'handlers': ['slow_queries_queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
@@ -18,9 +18,12 @@ from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import RedirectView
 
+from polls import views as polls_views
+
 urlpatterns = [
     path("", RedirectView.as_view(url='/polls')),
     path("polls/", include("polls.urls")),
     path("admin/", admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics', polls_views.metrics, name='metrics'),
 ]
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .middleware import instrument_connection
+        from .sqlite import apply_pragmas
+        connection_created.connect(
+            apply_pragmas, dispatch_uid="polls_sqlite_pragmas")
+        connection_created.connect(
+            instrument_connection, dispatch_uid="polls_query_wrappers")
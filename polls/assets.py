@@ -0,0 +1,45 @@
+"""Build step of the static files: precompressed variants.
+
+The images are committed optimized already, so they are copied as is.
+Brotli variants are written when the ``brotli`` package is installed.
+"""
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files worth compressing; images and fonts are compressed already.
+COMPRESSIBLE = {".css", ".js", ".svg", ".txt", ".json", ".map", ".html",
+                ".xml", ".ico"}
+
+# A variant is kept when it saves at least this fraction of the file.
+MIN_SAVING = 0.05
+
+# Content encodings of the variants, by file suffix, best first.
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def write_variants(path: str) -> list:
+    """Write the gzip and Brotli variants of a static file next to it.
+
+    Returns:
+        the paths of the variants written
+    """
+    if os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return []
+    with open(path, "rb") as source:
+        data = source.read()
+    variants = {".gz": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    written = []
+    for suffix, compressed in variants.items():
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            with open(path + suffix, "wb") as variant:
+                variant.write(compressed)
+            written.append(path + suffix)
+    return written
@@ -0,0 +1,147 @@
+"""Async versions of the polls views for ASGI deployments.
+
+They are routed instead of the views in polls.views when
+``POLLS_ASYNC_VIEWS`` is on. Each one resolves the user with
+``request.auser()`` and reads through the async ORM, so an ASGI worker
+serves the pages without a thread hop per request. Template rendering
+and the vote transaction still run in Django's sync thread, as Django
+has no async templates or transactions.
+"""
+
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import generic
+
+from .etags import acondition, aindex_etag, aquestion_etag
+from .ingest import submit_vote
+from .metadata import aget_question, find_choice
+from .models import Choice, Vote
+from .pagination import akeyset_paginate
+from .throttle import admission_control
+from .views import DetailView, IndexView, ResultsView, revalidate
+
+logger = logging.getLogger(__name__)
+vote_logger = logging.getLogger("polls.votes")
+
+
+def resolve_user(view):
+    """Load the user of the request without blocking, so that the sync
+    code reading request.user afterwards never queries."""
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+@method_decorator([resolve_user, revalidate, acondition(aindex_etag)],
+                  name="dispatch")
+class AsyncIndexView(IndexView):
+    """Async version of IndexView."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await generic.View.dispatch(self, request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        self.page = await akeyset_paginate(
+            self.get_published(), **self.get_page_kwargs())
+        self.object_list = self.page.object_list
+        if settings.POLLS_VOTED_BADGE and request.user.is_authenticated:
+            self.mark_voted(self.object_list,
+                            await Vote.objects.avoted_map(request.user))
+        return self.render_to_response(self.get_context_data())
+
+
+class AsyncQuestionPageMixin:
+    """Async dispatch of the detail and results pages."""
+
+    async def aget_object(self):
+        """Return the question, raising Http404 when it is missing."""
+        question = self.prepare(await aget_question(self.kwargs["pk"]))
+        user = self.request.user
+        if user.is_authenticated:
+            self.mark_voted(question, await Vote.objects.avoted_map(user))
+        return question
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            self.object = await self.aget_object()
+        except Http404:
+            return redirect(reverse("polls:index"))
+        redirection = self.redirect_for(self.object)
+        if redirection is not None:
+            return redirection
+        return await generic.View.dispatch(self, request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(
+            self.get_context_data(object=self.object))
+
+
+@method_decorator([resolve_user, revalidate, acondition(aquestion_etag)],
+                  name="dispatch")
+class AsyncDetailView(AsyncQuestionPageMixin, DetailView):
+    """Async version of DetailView."""
+
+
+@method_decorator([resolve_user, revalidate, acondition(aquestion_etag)],
+                  name="dispatch")
+class AsyncResultsView(AsyncQuestionPageMixin, ResultsView):
+    """Async version of ResultsView."""
+
+
+@admission_control
+async def vote(request, question_id):
+    """Async version of polls.views.vote."""
+    vote_logger.info("Vote submitted for poll #%s", question_id)
+    question = await aget_question(question_id)
+    if question is None:
+        raise Http404("No such poll.")
+    try:
+        selected_choice = find_choice(question, request.POST["choice"])
+        vote_logger.info("Question %s vote for choice %s",
+                         question_id, request.POST["choice"])
+    except (KeyError, Choice.DoesNotExist):
+        logger.error(
+            "The choice has not been selected for the question %s.",
+            question_id)
+        messages.error(
+            request,
+            "You didn't select a choice. Please consider doing so.")
+        # Rendered by the handler, in the sync thread.
+        return TemplateResponse(
+            request,
+            "polls/detail.html",
+            {
+                "question": question
+            },
+        )
+    this_user = await request.auser()
+    if not this_user.is_authenticated:
+        next_url = reverse(
+            'polls:detail',
+            args=[question_id])
+        redirect_url = reverse('login')
+        return HttpResponseRedirect(
+            f"{redirect_url}?next={next_url}"
+        )
+    await sync_to_async(submit_vote)(this_user, selected_choice)
+    messages.success(
+        request,
+        "Your vote has been saved!"
+    )
+    return HttpResponseRedirect(
+        reverse(
+            "polls:results",
+            args=(question.id,)
+        )
+    )
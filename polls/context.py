@@ -0,0 +1,29 @@
+"""The request being served, for the code running its queries.
+
+ServerTimingMiddleware makes each request the current one while it is
+served. Under ASGI the concurrent requests share the connection of the
+sync thread, so the execute wrappers of polls.middleware and
+polls.slowlog are not registered per request: they are installed once
+on every connection as it opens (see PollsConfig.ready) and look the
+request up here at each query.
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+_request = contextvars.ContextVar("polls_request", default=None)
+
+
+def current_request():
+    """Return the request being served, or None."""
+    return _request.get()
+
+
+@contextmanager
+def serving(request):
+    """Make the request the current one inside the block."""
+    token = _request.set(request)
+    try:
+        yield
+    finally:
+        _request.reset(token)
@@ -0,0 +1,137 @@
+"""ETag validators of the polls pages.
+
+Each function is an ``etag_func`` for
+:func:`django.views.decorators.http.condition`, or for acondition()
+below in the async views. It computes a validator
+from one small query, without rendering, so an unchanged page answers
+304 Not Modified before the view runs.
+
+The pages greet the user and carry a CSRF token, so every validator
+also covers the user, the CSRF cookie and the current day (the day
+decides whether a poll is open). Pages with pending messages get no
+validator, so the messages are always shown.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Max, Subquery
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .models import Question, QuestionsVersion, Vote
+
+
+def _etag(request, *parts):
+    """Return the ETag of the parts for the request,
+    or None when the page must be rendered anyway."""
+    if len(messages.get_messages(request)):
+        return None
+    parts = (
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+        timezone.now().date(),
+    ) + parts
+    digest = hashlib.sha1(repr(parts).encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def _published():
+    """Return the published questions."""
+    return Question.objects.filter(pub_date__lte=timezone.now())
+
+
+# Summary of the published questions covered by the index validator,
+# in one query: the latest publication date, read from the pub_date
+# index, and the version of the questions, bumped by every edit and
+# deletion. The version is read by a subquery run once, wrapped in
+# Max() as aggregate() only takes aggregates.
+INDEX_STATE = {
+    "latest": Max("pub_date"),
+    "version": Max(Subquery(
+        QuestionsVersion.objects.filter(pk=1).values("version"))),
+}
+
+
+def _index_voted(voted: dict) -> tuple:
+    """Return the part of the voted map shown by the index badges."""
+    if not settings.POLLS_VOTED_BADGE:
+        return ()
+    return tuple(sorted(voted.items()))
+
+
+def index_etag(request, *args, **kwargs):
+    """Validator of the index: the latest published poll, the version
+    of the questions (bumped by every edit), the page and the polls the
+    user voted in."""
+    published = _published().aggregate(**INDEX_STATE)
+    voted = {}
+    if request.user.is_authenticated:
+        voted = Vote.objects.voted_map(request.user)
+    return _etag(request, published["latest"], published["version"],
+                 request.GET.urlencode(), _index_voted(voted))
+
+
+async def aindex_etag(request, *args, **kwargs):
+    """Async version of index_etag()."""
+    published = await _published().aaggregate(**INDEX_STATE)
+    voted = {}
+    if request.user.is_authenticated:
+        voted = await Vote.objects.avoted_map(request.user)
+    return _etag(request, published["latest"], published["version"],
+                 request.GET.urlencode(), _index_voted(voted))
+
+
+def _question_state(pk):
+    """Return the query of the question fields covered by the
+    detail and results validators."""
+    return Question.objects.filter(pk=pk).values_list(
+        "question_text", "pub_date", "end_date", "tally_version")
+
+
+def question_etag(request, pk, *args, **kwargs):
+    """Validator of the detail and results pages: the question, its
+    tally version (bumped by votes and choice edits) and the user's
+    vote."""
+    row = _question_state(pk).first()
+    if row is None:
+        return None
+    voted = {}
+    if request.user.is_authenticated:
+        voted = Vote.objects.voted_map(request.user)
+    return _etag(request, pk, *row, voted.get(pk))
+
+
+async def aquestion_etag(request, pk, *args, **kwargs):
+    """Async version of question_etag()."""
+    row = await _question_state(pk).afirst()
+    if row is None:
+        return None
+    voted = {}
+    if request.user.is_authenticated:
+        voted = await Vote.objects.avoted_map(request.user)
+    return _etag(request, pk, *row, voted.get(pk))
+
+
+def acondition(etag_func):
+    """Async version of condition() for a coroutine etag_func.
+
+    The user must already be resolved on the request, see
+    polls.async_views.resolve_user.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = await etag_func(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if etag and request.method in ("GET", "HEAD"):
+                response.headers.setdefault("ETag", etag)
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,138 @@
+"""Streaming exports of the votes and the per-question results.
+
+Rows are read with ``values_list`` through a chunked iterator (a
+server-side cursor where the database has one) and encoded a chunk at a
+time, so an export holds one chunk in memory however many votes there
+are.
+
+Votes carry no timestamp, so the date range filters on the publication
+date of their question.
+"""
+
+import csv
+import datetime
+import io
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .models import Choice, Vote
+
+# Rows fetched from the database, and written out, at a time.
+CHUNK_SIZE = 2000
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Exported fields of each kind of export, in column order.
+COLUMNS = {
+    "votes": ("id", "question_id", "choice_id", "user_id"),
+    "results": ("question_id", "question__question_text", "id",
+                "choice_text", "votes"),
+}
+HEADERS = {
+    "votes": ("vote_id", "question_id", "choice_id", "user_id"),
+    "results": ("question_id", "question_text", "choice_id",
+                "choice_text", "votes"),
+}
+
+
+def _start_of(day: datetime.date) -> datetime.datetime:
+    """Return the start of the UTC day, as the poll status uses."""
+    return datetime.datetime.combine(day, datetime.time.min,
+                                     tzinfo=datetime.timezone.utc)
+
+
+def parse_filters(params) -> dict:
+    """Return the export_queryset() filters of the request parameters
+    ?question= (repeatable), ?since= and ?until= (ISO dates).
+
+    Raises:
+        ValueError: when a parameter is malformed
+    """
+    since, until = params.get("since"), params.get("until")
+    return {
+        "questions": [int(pk) for pk in params.getlist("question")],
+        "since": datetime.date.fromisoformat(since) if since else None,
+        "until": datetime.date.fromisoformat(until) if until else None,
+    }
+
+
+def export_queryset(kind: str, questions=None, since=None, until=None):
+    """Return the rows of an export as a values_list queryset.
+
+    Args:
+        kind: "votes" or "results"
+        questions: only export these question ids
+        since: only export the questions published on this day or later
+        until: only export the questions published on this day or earlier
+    """
+    rows = Vote.objects.all() if kind == "votes" else Choice.objects.all()
+    if questions:
+        rows = rows.filter(question_id__in=questions)
+    if since is not None:
+        rows = rows.filter(question__pub_date__gte=_start_of(since))
+    if until is not None:
+        rows = rows.filter(question__pub_date__lt=_start_of(
+            until + datetime.timedelta(days=1)))
+    order = ("pk",) if kind == "votes" else ("question_id", "pk")
+    return rows.order_by(*order).values_list(*COLUMNS[kind])
+
+
+class _Encoder:
+    """Encodes rows of one export as CSV or NDJSON text."""
+
+    def __init__(self, kind: str, fmt: str):
+        self.header = HEADERS[kind]
+        self.fmt = fmt
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def start(self) -> str:
+        """Return the text before the first row."""
+        if self.fmt != "csv":
+            return ""
+        self.writer.writerow(self.header)
+        return self.take()
+
+    def add(self, row):
+        """Encode the row into the pending text."""
+        if self.fmt == "csv":
+            self.writer.writerow(row)
+        else:
+            self.buffer.write(json.dumps(dict(zip(self.header, row))) + "\n")
+
+    def take(self) -> str:
+        """Return and clear the pending text."""
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+
+def stream_export(queryset, kind: str, fmt: str):
+    """Yield the export of the queryset one chunk of rows at a time."""
+    encoder = _Encoder(kind, fmt)
+    yield encoder.start()
+    for n, row in enumerate(queryset.iterator(chunk_size=CHUNK_SIZE), 1):
+        encoder.add(row)
+        if not n % CHUNK_SIZE:
+            yield encoder.take()
+    yield encoder.take()
+
+
+async def astream_export(queryset, kind: str, fmt: str):
+    """Async version of stream_export(), for ASGI responses.
+
+    QuerySet.aiterator() runs a values_list() query in the event loop,
+    so the chunks are fetched from the sync iterator in Django's sync
+    thread instead.
+    """
+    encoder = _Encoder(kind, fmt)
+    yield encoder.start()
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+    next_chunk = sync_to_async(lambda: list(islice(rows, CHUNK_SIZE)))
+    while chunk := await next_chunk():
+        for row in chunk:
+            encoder.add(row)
+        yield encoder.take()
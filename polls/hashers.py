@@ -0,0 +1,68 @@
+"""Password hashers whose cost comes from the settings.
+
+They keep the algorithm names of Django's hashers, so existing hashes
+still verify, and Django rehashes a password at the next login whenever
+its cost differs from the settings. See ``PASSWORD_HASHER`` in the
+settings and ``python manage.py bench_login`` to pick the cost.
+"""
+
+import base64
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher)
+
+# hashlib.scrypt() refuses a maxmem over INT_MAX.
+SCRYPT_MAXMEM_CAP = 2 ** 31 - 1
+
+
+def scrypt_maxmem(n: int, r: int, p: int) -> int:
+    """Return the memory limit of scrypt with the parameters.
+
+    scrypt needs about 128 * r * (n + p) bytes, over hashlib's 32 MiB
+    default from n = 2 ** 15 up; the limit leaves twice that, up to
+    the largest limit hashlib takes (SCRYPT_MAXMEM_CAP).
+    """
+    return min(2 * 128 * r * (n + p + 2), SCRYPT_MAXMEM_CAP)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with PASSWORD_PBKDF2_ITERATIONS iterations."""
+
+    @property
+    def iterations(self):
+        return (settings.PASSWORD_PBKDF2_ITERATIONS
+                or PBKDF2PasswordHasher.iterations)
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """scrypt with the PASSWORD_SCRYPT_* parameters."""
+
+    @property
+    def work_factor(self):
+        return (settings.PASSWORD_SCRYPT_WORK_FACTOR
+                or ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return (settings.PASSWORD_SCRYPT_BLOCK_SIZE
+                or ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return (settings.PASSWORD_SCRYPT_PARALLELISM
+                or ScryptPasswordHasher.parallelism)
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        # Same as Django's, with the memory limit sized for the n and r
+        # of the hash, which may be from a larger cost than the settings.
+        self._check_encode_args(password, salt)
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = hashlib.scrypt(password.encode(), salt=salt.encode(),
+                               n=n, r=r, p=p, maxmem=scrypt_maxmem(n, r, p),
+                               dklen=64)
+        hash_ = base64.b64encode(hash_).decode("ascii").strip()
+        return "%s$%d$%s$%d$%d$%s" % (self.algorithm, n, salt, r, p, hash_)
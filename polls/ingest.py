@@ -0,0 +1,305 @@
+"""Write-behind ingestion of votes.
+
+With ``POLLS_VOTE_INGEST = "buffered"`` the vote view hands validated
+votes to an in-process bounded queue instead of writing them itself.
+A flusher thread coalesces the queued votes (the last vote of a user on
+a question wins) and saves each batch in a few transactions, so a burst
+of votes costs a handful of writes instead of one transaction per vote.
+
+A vote waits in the buffer for at most ``POLLS_VOTE_MAX_STALENESS``
+milliseconds, less when ``POLLS_VOTE_FLUSH_BATCH`` votes are queued
+first. When the buffer is full the vote is written synchronously, and
+supersedes the votes of the user on the question still queued, so the
+last vote wins either way. Whatever is still queued is flushed when the
+process exits.
+"""
+
+import atexit
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Choice, Question, Vote
+
+logger = logging.getLogger(__name__)
+
+
+# Votes written per transaction. The lookup of the votes they replace
+# stays well under the SQLite limits on query size.
+CHUNK_SIZE = 500
+
+
+def _persist_chunk(votes: dict):
+    """Save the votes in one transaction and move the tallies of the
+    choices they replace and select."""
+    users = {user_id for user_id, _ in votes}
+    questions = {question_id for _, question_id in votes}
+    with transaction.atomic():
+        old = {
+            (user_id, question_id): choice_id
+            for user_id, question_id, choice_id in Vote.objects.filter(
+                user_id__in=users, question_id__in=questions
+            ).values_list("user_id", "question_id", "choice_id")
+            if (user_id, question_id) in votes
+        }
+        deltas, moved = Counter(), set()
+        for key, choice_id in votes.items():
+            if old.get(key) == choice_id:
+                continue
+            deltas[choice_id] += 1
+            if key in old:
+                deltas[old[key]] -= 1
+            moved.add(key[1])
+        Vote.objects.bulk_create(
+            [
+                Vote(user_id=user_id, question_id=question_id,
+                     choice_id=choice_id)
+                for (user_id, question_id), choice_id in votes.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "question"],
+            update_fields=["choice"],
+        )
+        by_delta = {}
+        for choice_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(choice_id)
+        # Clamped at zero like the decrement of VoteManager.record, so
+        # that a tally behind its votes cannot break the CHECK of the
+        # column.
+        for delta, choice_ids in by_delta.items():
+            Choice.objects.filter(pk__in=choice_ids).update(
+                votes=Greatest(F("votes") + delta, 0))
+        Question.objects.filter(pk__in=moved).bump_tally_version()
+        Vote.objects.forget_voted(users)
+
+
+def persist_votes(votes: dict) -> int:
+    """Save the votes, CHUNK_SIZE per transaction, moving the tallies
+    of the choices they touch.
+
+    Saving a vote again changes nothing, so the votes of a failed call
+    can be saved again whole.
+
+    Args:
+        votes: the choice id of each (user id, question id) pair
+
+    Returns:
+        the number of votes saved
+    """
+    items = list(votes.items())
+    for start in range(0, len(items), CHUNK_SIZE):
+        _persist_chunk(dict(items[start:start + CHUNK_SIZE]))
+    return len(items)
+
+
+class VoteBuffer:
+    """Bounded queue of votes waiting to be written."""
+
+    def __init__(self, max_size: int, max_staleness: float,
+                 flush_batch: int):
+        """
+        Args:
+            max_size: the most votes the queue holds
+            max_staleness: the longest a vote waits, in seconds
+            flush_batch: flush as soon as this many votes are queued
+        """
+        self.max_staleness = max_staleness
+        self.flush_batch = flush_batch
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        # The sequence number of the last vote submitted or written
+        # synchronously for each (user id, question id) pair with votes
+        # still queued or being saved, and how many of those there are.
+        # Saves hold _save_lock, so a vote checked as the last one is
+        # written before any later one.
+        self._sequence = itertools.count()
+        self._latest = {}
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def start(self):
+        """Start the flusher thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="polls-vote-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher thread and flush the queued votes."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def submit(self, user_id: int, question_id: int, choice_id: int) -> bool:
+        """Queue a vote.
+
+        Returns:
+            False when the buffer is full or stopped
+        """
+        if self._stopping.is_set():
+            return False
+        key = (user_id, question_id)
+        with self._lock:
+            number = next(self._sequence)
+            try:
+                self._queue.put_nowait((key, choice_id, number))
+            except queue.Full:
+                return False
+            self._latest[key] = number
+            self._pending[key] += 1
+        return True
+
+    def record(self, user, choice):
+        """Write the vote of the user for the choice synchronously, so
+        that the votes of the user on the question still queued are
+        dropped instead of overwriting it."""
+        key = (user.pk, choice.question_id)
+        with self._save_lock:
+            with self._lock:
+                self._latest[key] = next(self._sequence)
+            try:
+                Vote.objects.record(user, choice)
+            finally:
+                with self._lock:
+                    if not self._pending[key]:
+                        self._forget(key)
+
+    def flush(self) -> int:
+        """Write every queued vote from the calling thread.
+
+        Returns:
+            the number of votes saved after coalescing
+        """
+        votes = {}
+        while True:
+            try:
+                self._take(votes, block=False)
+            except queue.Empty:
+                break
+        return self._save(votes)
+
+    def _forget(self, key):
+        """Drop the sequence of a pair without votes left to save.
+        Called with _lock held."""
+        self._pending.pop(key, None)
+        self._latest.pop(key, None)
+
+    def _save(self, batch: dict) -> int:
+        """Save a batch of votes, leaving out the ones superseded by a
+        later vote."""
+        with self._save_lock:
+            with self._lock:
+                votes = {
+                    key: choice_id
+                    for key, (choice_id, number, _) in batch.items()
+                    if self._latest.get(key) == number
+                }
+            try:
+                return self._write(votes)
+            finally:
+                with self._lock:
+                    for key, (_, _, count) in batch.items():
+                        self._pending[key] -= count
+                        if not self._pending[key]:
+                            self._forget(key)
+
+    @staticmethod
+    def _write(votes: dict) -> int:
+        """Save the votes. When it fails, save them one by one, so only
+        the votes that cannot be saved are lost."""
+        try:
+            return persist_votes(votes)
+        except Exception:
+            logger.exception("Failed to save %d buffered votes, "
+                             "saving them one by one", len(votes))
+        saved = 0
+        for key, choice_id in votes.items():
+            try:
+                saved += persist_votes({key: choice_id})
+            except Exception:
+                logger.exception("Lost the vote of user %s on question %s",
+                                 *key)
+        return saved
+
+    def _take(self, votes: dict, block: bool = True, timeout=None):
+        """Move one vote from the queue into the batch, counting the
+        votes of the pair it replaces."""
+        key, choice_id, number = self._queue.get(block, timeout)
+        count = votes[key][2] if key in votes else 0
+        votes[key] = (choice_id, number, count + 1)
+
+    def _collect(self) -> dict:
+        """Wait for a vote, then gather more until the batch is full
+        or the first vote is about to go stale."""
+        votes = {}
+        try:
+            self._take(votes, timeout=self.max_staleness)
+        except queue.Empty:
+            return votes
+        deadline = time.monotonic() + self.max_staleness
+        pending = 1
+        while pending < self.flush_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._take(votes, timeout=remaining)
+            except queue.Empty:
+                break
+            pending += 1
+        return votes
+
+    def _run(self):
+        """Flush batches until the buffer is stopped."""
+        while not self._stopping.is_set():
+            votes = self._collect()
+            if not votes:
+                continue
+            close_old_connections()
+            self._save(votes)
+        connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer() -> VoteBuffer:
+    """Return the running buffer of this process, starting it on
+    first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(
+                max_size=settings.POLLS_VOTE_BUFFER_SIZE,
+                max_staleness=settings.POLLS_VOTE_MAX_STALENESS / 1000,
+                flush_batch=settings.POLLS_VOTE_FLUSH_BATCH,
+            )
+            _buffer.start()
+        return _buffer
+
+
+def submit_vote(user, choice):
+    """Save the vote of the user for the choice, through the buffer
+    when buffered ingestion is enabled and it has room."""
+    if settings.POLLS_VOTE_INGEST != "buffered":
+        Vote.objects.record(user, choice)
+        return
+    buffer = get_vote_buffer()
+    if not buffer.submit(user.pk, choice.question_id, choice.pk):
+        buffer.record(user, choice)
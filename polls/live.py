@@ -0,0 +1,164 @@
+"""Live vote tallies for the results page.
+
+Each process keeps one channel per watched question. A single task per
+channel polls the question's tally version and, when it moves, reads
+the tallies once and wakes every subscriber, so the database load does
+not grow with the number of people watching. Subscribers are plain
+async generators waiting on a condition, not threads, which is what
+lets an ASGI worker hold thousands of idle streams.
+"""
+
+import asyncio
+import json
+import logging
+
+from django.conf import settings
+
+from .models import Choice, Question
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two SSE comments sent to keep idle streams open.
+KEEPALIVE = 15
+
+# Milliseconds a browser waits before asking again for the tallies sent
+# once by a WSGI worker, so open pages do not poll it every second.
+SNAPSHOT_RETRY = 60000
+
+
+class TallyChannel:
+    """The latest tallies of one question and its subscribers."""
+
+    def __init__(self):
+        self.version = None
+        self.tallies = {}
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class TallyBroadcaster:
+    """Fans the tally changes of each question out to its subscribers."""
+
+    def __init__(self, interval: float):
+        """
+        Args:
+            interval: seconds between two checks of a watched question
+        """
+        self.interval = interval
+        self.channels = {}
+
+    async def listen(self, question_id: int):
+        """Yield the tallies of the question that changed since the
+        previous yield, starting with all of them.
+
+        None is yielded when nothing changed for KEEPALIVE seconds.
+        """
+        channel = self._join(question_id)
+        sent, seen = {}, None
+        try:
+            while True:
+                # Never yield with the lock held: a subscriber slow to
+                # take the next value would stop the refresh of the
+                # channel for all the others.
+                idle = False
+                async with channel.changed:
+                    try:
+                        await asyncio.wait_for(
+                            channel.changed.wait_for(
+                                lambda: channel.version != seen),
+                            KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        idle = True
+                    else:
+                        seen, tallies = channel.version, channel.tallies
+                if idle:
+                    yield None
+                    continue
+                delta = {
+                    pk: votes for pk, votes in tallies.items()
+                    if sent.get(pk) != votes
+                }
+                sent = tallies
+                if delta:
+                    yield delta
+        finally:
+            self._leave(question_id)
+
+    def _join(self, question_id: int) -> TallyChannel:
+        """Subscribe to the channel of the question, starting its
+        polling task when it is the first subscriber."""
+        channel = self.channels.get(question_id)
+        if channel is None:
+            channel = self.channels[question_id] = TallyChannel()
+        channel.subscribers += 1
+        if channel.task is None:
+            channel.task = asyncio.create_task(
+                self._poll(question_id, channel))
+        return channel
+
+    def _leave(self, question_id: int):
+        """Unsubscribe from the channel, dropping it when it was the
+        last subscriber."""
+        channel = self.channels[question_id]
+        channel.subscribers -= 1
+        if not channel.subscribers:
+            channel.task.cancel()
+            del self.channels[question_id]
+
+    async def _poll(self, question_id: int, channel: TallyChannel):
+        """Refresh the channel whenever the tally version moves."""
+        while True:
+            try:
+                await self._refresh(question_id, channel)
+            except Exception:
+                logger.exception("Failed to refresh the tallies of poll #%s",
+                                 question_id)
+            await asyncio.sleep(self.interval)
+
+    async def _refresh(self, question_id: int, channel: TallyChannel):
+        """Read the tallies when the version moved and wake the
+        subscribers."""
+        version = await Question.objects.filter(
+            pk=question_id
+        ).values_list("tally_version", flat=True).afirst()
+        if version == channel.version:
+            return
+        tallies = {
+            pk: votes async for pk, votes in Choice.objects.filter(
+                question_id=question_id
+            ).values_list("pk", "votes")
+        }
+        async with channel.changed:
+            channel.version, channel.tallies = version, tallies
+            channel.changed.notify_all()
+
+
+_broadcasters = {}
+
+
+def get_broadcaster() -> TallyBroadcaster:
+    """Return the broadcaster of the running event loop."""
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        for stale in [key for key in _broadcasters if key.is_closed()]:
+            del _broadcasters[stale]
+        broadcaster = _broadcasters[loop] = TallyBroadcaster(
+            settings.POLLS_LIVE_INTERVAL)
+    return broadcaster
+
+
+def tally_event(tallies: dict) -> str:
+    """Format tallies as a server-sent event."""
+    return f"event: tally\ndata: {json.dumps(tallies)}\n\n"
+
+
+async def tally_stream(question_id: int):
+    """Server-sent events with the tally changes of the question."""
+    yield f"retry: {int(settings.POLLS_LIVE_INTERVAL * 1000)}\n\n"
+    async for delta in get_broadcaster().listen(question_id):
+        if delta is None:
+            yield ": keepalive\n\n"
+        else:
+            yield tally_event(delta)
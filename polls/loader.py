@@ -0,0 +1,215 @@
+"""Streaming loader of the JSON fixtures in data/.
+
+``loaddata`` parses a whole fixture into memory and saves its objects
+one at a time, sending signals. This loader reads the fixture's array
+one item at a time, validates the foreign keys of a batch in one query
+per field and inserts the batch with ``bulk_create`` in its own
+transaction, so the memory it holds does not grow with the file.
+"""
+
+import json
+import re
+from itertools import groupby, islice
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.core.serializers import python
+from django.db import connection, transaction
+
+from .metadata import forget_questions
+from .models import Choice, Question, QuestionsVersion, Vote
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+
+class _ArrayReader:
+    """Reads the items of a JSON array from a text stream, holding
+    about one chunk and one item in memory."""
+
+    def __init__(self, stream, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def _read(self):
+        """Append the next chunk to the unread part of the buffer."""
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            raise ValueError("The fixture ends inside its array.")
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Return the next character that is not whitespace."""
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self._read()
+
+    def expect(self, chars: str) -> str:
+        """Consume and return the next character, one of chars."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} in the fixture, found {char!r}.")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """Consume and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, self.pos = _decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError as error:
+                # Most likely the value goes on in the next chunk.
+                try:
+                    self._read()
+                except ValueError:
+                    raise error from None
+
+
+def iter_json_array(stream, chunk_size: int = 1 << 16):
+    """Yield the items of the JSON array in the text stream."""
+    reader = _ArrayReader(stream, chunk_size)
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.decode()
+        if reader.expect(",]") == "]":
+            return
+
+
+def _dangling(model, objects: list) -> list:
+    """Return the objects whose foreign keys point at missing rows,
+    with one query per foreign key of the model."""
+    dangling = set()
+    for field in model._meta.concrete_fields:
+        if not field.many_to_one and not field.one_to_one:
+            continue
+        ids = {getattr(obj, field.attname) for obj in objects} - {None}
+        if not ids:
+            continue
+        target = field.target_field
+        found = set(field.related_model._base_manager.filter(
+            **{f"{target.attname}__in": ids}
+        ).values_list(target.attname, flat=True))
+        dangling.update(
+            obj.pk for obj in objects
+            if getattr(obj, field.attname) in ids - found)
+    return [obj for obj in objects if obj.pk in dangling]
+
+
+def _set_m2m(model, deserialized: list):
+    """Replace the many-to-many links of the objects, as loaddata
+    does."""
+    for field in model._meta.many_to_many:
+        links = [
+            (obj.object.pk, pk) for obj in deserialized
+            for pk in obj.m2m_data.get(field.name, ())
+        ]
+        through = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        through._base_manager.filter(**{
+            f"{source}__in": [obj.object.pk for obj in deserialized]
+        }).delete()
+        through._base_manager.bulk_create([
+            through(**{f"{source}_id": obj_pk, f"{target}_id": pk})
+            for obj_pk, pk in links
+        ])
+
+
+def _fill_vote_questions(votes: list):
+    """Set the question of the votes of older dumps, which only have
+    the choice, from their choices in one query."""
+    missing = [vote for vote in votes if vote.question_id is None]
+    if not missing:
+        return
+    questions = dict(Choice.objects.filter(
+        pk__in={vote.choice_id for vote in missing}
+    ).values_list("pk", "question_id"))
+    for vote in missing:
+        vote.question_id = questions.get(vote.choice_id)
+
+
+def _save(model, items: list, skip_invalid: bool) -> tuple:
+    """Insert or overwrite the fixture items of one model.
+
+    Returns:
+        the number of objects saved and skipped
+    """
+    deserialized = list(python.Deserializer(items))
+    objects = [obj.object for obj in deserialized]
+    if model is Vote:
+        _fill_vote_questions(objects)
+    dangling = _dangling(model, objects)
+    if dangling and not skip_invalid:
+        raise ValueError(
+            f"{len(dangling)} {model._meta.label} object(s) point at "
+            f"missing rows, starting with pk {dangling[0].pk}.")
+    if dangling:
+        skipped = {obj.pk for obj in dangling}
+        deserialized = [obj for obj in deserialized
+                        if obj.object.pk not in skipped]
+        objects = [obj.object for obj in deserialized]
+    model._base_manager.bulk_create(
+        objects,
+        update_conflicts=True,
+        unique_fields=[model._meta.pk.name],
+        update_fields=[field.name for field in model._meta.concrete_fields
+                       if not field.primary_key],
+    )
+    _set_m2m(model, deserialized)
+    if model is Vote:
+        Vote.objects.forget_voted({obj.user_id for obj in objects})
+    elif model is Question:
+        forget_questions([obj.pk for obj in objects])
+        QuestionsVersion.objects.bump()
+    elif model is Choice:
+        forget_questions({obj.question_id for obj in objects})
+    return len(objects), len(dangling)
+
+
+def load_fixture(stream, batch_size: int = 1000, skip_invalid: bool = False,
+                 progress=None) -> dict:
+    """Load a JSON fixture, one transaction per batch of items.
+
+    An error stops the load after the batches already committed.
+    Objects are saved without sending signals, so the vote tallies
+    of the choices are recounted once at the end.
+
+    Args:
+        stream: text stream of the fixture
+        batch_size: items per transaction
+        skip_invalid: skip the objects pointing at missing rows
+            instead of failing
+        progress: called with the counts after each batch
+
+    Returns:
+        the number of objects saved and skipped
+    """
+    counts = {"saved": 0, "skipped": 0}
+    models = set()
+    items = iter_json_array(stream)
+    while batch := list(islice(items, batch_size)):
+        with transaction.atomic():
+            for label, group in groupby(batch, key=lambda item: item["model"]):
+                model = apps.get_model(label)
+                models.add(model)
+                saved, skipped = _save(model, list(group), skip_invalid)
+                counts["saved"] += saved
+                counts["skipped"] += skipped
+        if progress is not None:
+            progress(counts)
+    # Explicit primary keys leave the sequences behind on some databases.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+    if models & {Choice, Vote}:
+        Choice.objects.recount()
+    return counts
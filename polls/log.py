@@ -0,0 +1,105 @@
+"""Logging that keeps disk writes off the request threads.
+
+QueueListenerHandler only puts records on a bounded queue; a listener
+thread per process hands them to the real handlers, such as the
+rotating file of ``LOGGING``. SampleFilter keeps a fraction of the
+per-vote info records.
+
+Both are referenced from ``LOGGING`` in the settings, so this module
+must not import Django.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+# logging.getHandlerByName() is new in Python 3.12.
+_get_handler = getattr(logging, "getHandlerByName", None) or \
+    logging._handlers.get
+
+
+class QueueListenerHandler(QueueHandler):
+    """Queues records for the handlers named in ``handlers``, which a
+    listener thread runs.
+
+    The thread starts on the first record of each process, so that
+    workers forked after the logging setup get their own. When the
+    queue is full, records are dropped and counted rather than blocking
+    the request.
+    """
+
+    def __init__(self, handlers: list, maxsize: int = 10000):
+        """
+        Args:
+            handlers: names of handlers of the same LOGGING config
+            maxsize: records held before new ones are dropped
+        """
+        super().__init__(queue.Queue(maxsize))
+        # dictConfig configures the handlers in the order of their
+        # names, so the targets configured after this one are looked up
+        # when the listener starts.
+        self.targets = {name: _get_handler(name) for name in handlers}
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+
+    def _targets(self) -> list:
+        """Return the handlers named in ``handlers``."""
+        for name, handler in self.targets.items():
+            if handler is None:
+                handler = self.targets[name] = _get_handler(name)
+            if handler is None:
+                raise ValueError(f"Unable to set the handler {name!r}")
+        return list(self.targets.values())
+
+    def _start(self):
+        """Start the listener thread of this process."""
+        self.listener = QueueListener(
+            self.queue, *self._targets(), respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+        atexit.register(self._stop)
+
+    def _stop(self):
+        """Write the queued records and stop the listener thread."""
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+
+    def emit(self, record):
+        # Called under the handler's lock.
+        if self.pid != os.getpid():
+            try:
+                self._start()
+            except Exception:
+                self.handleError(record)
+                return
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._stop()
+        super().close()
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a random fraction of the records below WARNING."""
+
+    def __init__(self, rate: float = 1.0):
+        """
+        Args:
+            rate: fraction of the info and debug records kept, 0 to 1
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
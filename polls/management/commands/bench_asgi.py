@@ -0,0 +1,93 @@
+"""Compare the throughput of the WSGI and ASGI handlers."""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the polls pages through the WSGI handler (one thread per "
+        "concurrent client) and the ASGI handler (one task per concurrent "
+        "client) and report the requests per second of each. Run it with "
+        "POLLS_ASYNC_VIEWS on and off to compare the sync and async views."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*",
+            help="Paths to request in turn (default: the polls index).")
+        parser.add_argument(
+            "--requests", type=int, default=2000,
+            help="Requests per handler.")
+        parser.add_argument(
+            "--concurrency", type=int, default=200,
+            help="Requests in flight at once.")
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or [reverse("polls:index")]
+        total, concurrency = options["requests"], options["concurrency"]
+        # Lets the test clients through ALLOWED_HOSTS.
+        setup_test_environment()
+        try:
+            report = {
+                "async_views": settings.POLLS_ASYNC_VIEWS,
+                "requests": total,
+                "concurrency": concurrency,
+                "paths": paths,
+                "wsgi": self.run_wsgi(paths, total, concurrency),
+                "asgi": asyncio.run(
+                    self.run_asgi(paths, total, concurrency)),
+            }
+        finally:
+            teardown_test_environment()
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def summarize(elapsed: float, statuses: list) -> dict:
+        """Return the throughput and the status codes of a run."""
+        counts = {}
+        for status in statuses:
+            counts[str(status)] = counts.get(str(status), 0) + 1
+        return {
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(len(statuses) / elapsed, 1),
+            "statuses": counts,
+        }
+
+    def run_wsgi(self, paths: list, total: int, concurrency: int) -> dict:
+        """Send the requests from a pool of threads."""
+        def fetch(n):
+            try:
+                return Client().get(paths[n % len(paths)]).status_code
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            statuses = list(pool.map(fetch, range(total)))
+        return self.summarize(time.perf_counter() - started, statuses)
+
+    async def run_asgi(self, paths: list, total: int,
+                       concurrency: int) -> dict:
+        """Send the requests from concurrent tasks on one event loop."""
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(n):
+            async with slots:
+                response = await client.get(paths[n % len(paths)])
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(fetch(n) for n in range(total)))
+        return self.summarize(time.perf_counter() - started, statuses)
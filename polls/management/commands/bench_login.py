@@ -0,0 +1,77 @@
+"""Measure the password check of a login with each hasher and cost."""
+
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher, get_hasher)
+from django.core.management.base import BaseCommand
+
+from polls.hashers import scrypt_maxmem
+
+# Iterations of the hashes in data/users.json.
+FIXTURE_ITERATIONS = [600000, 870000]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the password check of a login, which is nearly all of its "
+        "CPU, for the configured hasher and for each candidate cost, and "
+        "report the logins per second one core can serve as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pbkdf2-iterations", type=int, nargs="*",
+            default=FIXTURE_ITERATIONS,
+            help="Candidate PBKDF2 iteration counts.")
+        parser.add_argument(
+            "--scrypt-work-factors", type=int, nargs="*",
+            default=[2 ** 14, 2 ** 15],
+            help="Candidate scrypt work factors (n), with Django's r and p.")
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Password checks timed per hasher.")
+
+    def handle(self, *args, **options):
+        candidates = [("configured", get_hasher())]
+        for iterations in options["pbkdf2_iterations"]:
+            hasher = PBKDF2PasswordHasher()
+            hasher.iterations = iterations
+            candidates.append((f"pbkdf2_sha256 iterations={iterations}",
+                               hasher))
+        for work_factor in options["scrypt_work_factors"]:
+            hasher = ScryptPasswordHasher()
+            hasher.work_factor = work_factor
+            hasher.maxmem = scrypt_maxmem(work_factor, hasher.block_size,
+                                          hasher.parallelism)
+            candidates.append((
+                f"scrypt n={work_factor} r={hasher.block_size} "
+                f"p={hasher.parallelism}", hasher))
+        report = {
+            "password_hasher": settings.PASSWORD_HASHER,
+            "hashers": [
+                self.measure(name, hasher, options["repeat"])
+                for name, hasher in candidates
+            ],
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def measure(name: str, hasher, repeat: int) -> dict:
+        """Time the checks of a password hashed by the hasher."""
+        encoded = hasher.encode("benchmark", hasher.salt())
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            hasher.verify("benchmark", encoded)
+            timings.append(time.perf_counter() - started)
+        seconds = statistics.median(timings)
+        return {
+            "hasher": name,
+            "hash": encoded.rsplit("$", 1)[0],
+            "ms_per_login": round(seconds * 1000, 1),
+            "logins_per_second_per_core": round(1 / seconds, 1),
+        }
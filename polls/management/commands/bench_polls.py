@@ -0,0 +1,205 @@
+"""Synthetic load generator and latency benchmark of the polls pages."""
+
+import datetime
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+
+from polls.models import Choice, Question, Vote
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a throwaway test database with N questions x M choices "
+        "and K users casting V votes, drive the index, detail, results "
+        "and vote pages through the test client and report the p50, p95 "
+        "and p99 latency, the queries per request and the peak memory "
+        "of each page as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", type=int, default=200)
+        parser.add_argument("--choices", type=int, default=5,
+                            help="Choices per question.")
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--votes", type=int, default=5000,
+                            help="Votes cast before the run, at most one "
+                                 "per user and question.")
+        parser.add_argument("--requests", type=int, default=200,
+                            help="Requests per page.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the report to a file.")
+
+    def handle(self, *args, **options):
+        for name in ("questions", "choices", "users"):
+            if options[name] < 1:
+                raise CommandError(f"--{name} must be at least 1.")
+        if options["requests"] < 2:
+            raise CommandError(
+                "--requests must be at least 2 to compute percentiles.")
+        setup_test_environment()
+        workdir = tempfile.mkdtemp(prefix="bench_polls-")
+        self.isolate_databases(workdir)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            rng = random.Random(options["seed"])
+            started = time.perf_counter()
+            questions = self.generate(rng, options)
+            if not questions:
+                raise CommandError("Every generated question is closed.")
+            report = {
+                "options": {
+                    key: options[key] for key in (
+                        "questions", "choices", "users", "votes",
+                        "requests", "seed")
+                },
+                "generate_seconds": round(time.perf_counter() - started, 3),
+                "pages": self.drive(rng, questions, options["requests"]),
+            }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                report_file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def isolate_databases(workdir: str):
+        """Move the file-based test databases into the work directory.
+
+        A test database name set in the settings, as by the production
+        profile, may be the one of a test run going on, which would see
+        its database created and destroyed under it.
+        """
+        for alias in connections:
+            test = connections[alias].settings_dict.setdefault("TEST", {})
+            if test.get("NAME") and not test.get("MIRROR"):
+                test["NAME"] = os.path.join(workdir, f"{alias}.sqlite3")
+
+    def generate(self, rng, options) -> list:
+        """Fill the database and return the open questions."""
+        now = timezone.now()
+        questions = Question.objects.bulk_create([
+            Question(
+                question_text=f"Benchmark question {n}",
+                pub_date=now - datetime.timedelta(
+                    days=rng.randint(1, 365), seconds=rng.randint(0, 86399)),
+                # One poll in ten is closed.
+                end_date=(now - datetime.timedelta(hours=25)
+                          if n % 10 == 9 else None),
+            )
+            for n in range(options["questions"])
+        ])
+        choices = Choice.objects.bulk_create([
+            Choice(question=question, choice_text=f"Choice {n}")
+            for question in questions
+            for n in range(options["choices"])
+        ])
+        choices_of = {}
+        for choice in choices:
+            choices_of.setdefault(choice.question_id, []).append(choice)
+        # Hashing once keeps the users cheap to create but able to log in.
+        password = make_password("benchmark")
+        users = User.objects.bulk_create([
+            User(username=f"bench{n}", password=password)
+            for n in range(options["users"])
+        ])
+        pairs = set()
+        wanted = min(options["votes"], len(users) * len(questions))
+        while len(pairs) < wanted:
+            pairs.add((rng.choice(users).pk, rng.choice(questions).pk))
+        Vote.objects.bulk_create([
+            Vote(user_id=user_id, question_id=question_id,
+                 choice=rng.choice(choices_of[question_id]))
+            for user_id, question_id in sorted(pairs)
+        ], batch_size=1000)
+        Choice.objects.recount()
+        self.choices_of = choices_of
+        self.users = users
+        return [question for question in questions
+                if question.end_date is None]
+
+    # The votes all come from one address as fast as they can, which the
+    # token buckets would refuse.
+    @override_settings(POLLS_VOTE_USER_RATE=0, POLLS_VOTE_IP_RATE=0)
+    def drive(self, rng, questions: list, requests: int) -> dict:
+        """Request every page and measure it."""
+        anonymous = Client()
+        voters = []
+        for user in rng.sample(self.users, min(20, len(self.users))):
+            voter = Client()
+            voter.force_login(user)
+            voters.append(voter)
+
+        def vote():
+            question = rng.choice(questions)
+            choice = rng.choice(self.choices_of[question.pk])
+            return rng.choice(voters).post(
+                reverse("polls:vote", args=[question.pk]),
+                {"choice": choice.pk})
+
+        pages = {
+            "index": lambda: anonymous.get(reverse("polls:index")),
+            "detail": lambda: rng.choice(voters).get(reverse(
+                "polls:detail", args=[rng.choice(questions).pk])),
+            "results": lambda: anonymous.get(reverse(
+                "polls:results", args=[rng.choice(questions).pk])),
+            "vote": vote,
+        }
+        return {name: self.measure(request, requests)
+                for name, request in pages.items()}
+
+    @staticmethod
+    def measure(request, requests: int) -> dict:
+        """Send the requests one after the other and summarize them.
+
+        The latencies are measured in a pass of their own: tracing the
+        allocations and capturing the queries slow every request down,
+        so they are counted in a second pass.
+        """
+        latencies, queries, statuses = [], [], {}
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - started)
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+        tracemalloc.start()
+        try:
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as captured:
+                    request()
+                queries.append(len(captured))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        percentiles = statistics.quantiles(latencies, n=100)
+        return {
+            "p50_ms": round(percentiles[49] * 1000, 3),
+            "p95_ms": round(percentiles[94] * 1000, 3),
+            "p99_ms": round(percentiles[98] * 1000, 3),
+            "queries_mean": round(statistics.mean(queries), 2),
+            "queries_max": max(queries),
+            "peak_memory_kib": round(peak / 1024, 1),
+            "statuses": statuses,
+        }
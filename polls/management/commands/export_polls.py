@@ -0,0 +1,42 @@
+"""Export the votes or the results of the polls."""
+
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from polls.export import FORMATS, HEADERS, export_queryset, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the votes or the per-choice results as CSV or NDJSON, "
+        "holding one chunk of rows in memory. Votes carry no timestamp, "
+        "so --since and --until filter on the publication date of the "
+        "questions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(HEADERS))
+        parser.add_argument("--format", choices=sorted(FORMATS),
+                            default="csv")
+        parser.add_argument("--question", type=int, action="append",
+                            dest="questions",
+                            help="Only export this question (repeatable).")
+        parser.add_argument("--since", type=datetime.date.fromisoformat,
+                            help="First publication day, YYYY-MM-DD.")
+        parser.add_argument("--until", type=datetime.date.fromisoformat,
+                            help="Last publication day, YYYY-MM-DD.")
+        parser.add_argument("--output",
+                            help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        rows = export_queryset(
+            options["kind"], questions=options["questions"],
+            since=options["since"], until=options["until"])
+        chunks = stream_export(rows, options["kind"], options["format"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
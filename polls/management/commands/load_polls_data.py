@@ -0,0 +1,60 @@
+"""Load large JSON fixtures in batches."""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from polls.loader import load_fixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Load JSON fixtures in the format of data/*.json without reading "
+        "them whole: the items are parsed one at a time, their foreign "
+        "keys checked in batches and inserted with bulk_create, one "
+        "transaction per batch. Unlike loaddata, a failure keeps the "
+        "batches already loaded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures", nargs="+",
+                            help="Paths of the fixtures, loaded in order.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Objects per transaction.")
+        parser.add_argument("--skip-invalid", action="store_true",
+                            help="Skip the objects pointing at missing rows "
+                                 "instead of stopping.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        for path in options["fixtures"]:
+            self.load(path, options)
+
+    def load(self, path: str, options: dict):
+        """Load one fixture, reporting the progress after each batch."""
+        started = time.perf_counter()
+        try:
+            size = os.path.getsize(path) or 1
+            with open(path, encoding="utf-8") as stream:
+                def progress(counts):
+                    if options["verbosity"] < 1:
+                        return
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{path}: {stream.buffer.tell() * 100 // size}%, "
+                        f"{counts['saved']} object(s) saved "
+                        f"({counts['saved'] / elapsed:.0f}/s)")
+
+                counts = load_fixture(
+                    stream, batch_size=options["batch_size"],
+                    skip_invalid=options["skip_invalid"], progress=progress)
+        except (OSError, ValueError, IntegrityError) as error:
+            raise CommandError(f"Failed to load {path}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {counts['saved']} object(s) from {path} "
+            f"in {time.perf_counter() - started:.1f}s"
+            + (f", skipped {counts['skipped']}." if counts["skipped"]
+               else ".")))
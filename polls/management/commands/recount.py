@@ -0,0 +1,26 @@
+"""Rebuild the vote tallies of the choices."""
+
+from django.core.management.base import BaseCommand
+
+from polls.models import Choice
+
+
+class Command(BaseCommand):
+    help = "Rebuild the vote tally of each choice from the Vote table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "question_ids",
+            nargs="*",
+            type=int,
+            help="Only recount the choices of these questions.",
+        )
+
+    def handle(self, *args, **options):
+        choices = Choice.objects.all()
+        if options["question_ids"]:
+            choices = choices.filter(question_id__in=options["question_ids"])
+        updated = choices.recount()
+        self.stdout.write(
+            self.style.SUCCESS(f"Recounted {updated} choice(s).")
+        )
@@ -0,0 +1,39 @@
+"""Copy the primary SQLite database onto its read replicas."""
+
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the default SQLite database onto each replica in "
+        "POLLS_REPLICA_DATABASES with SQLite's online backup, which is "
+        "safe while the site is running. Run it periodically (cron, "
+        "systemd timer) to bound the replication lag."
+    )
+
+    def handle(self, *args, **options):
+        primary = connections["default"].settings_dict
+        if primary["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("sync_replicas only copies SQLite databases.")
+        if not settings.POLLS_REPLICA_DATABASES:
+            raise CommandError("No replica is configured, "
+                               "see DATABASE_REPLICAS.")
+        # A URI, like Django's own connections, so an in-memory test
+        # database is read too.
+        source = sqlite3.connect(primary["NAME"], uri=True)
+        try:
+            for alias in settings.POLLS_REPLICA_DATABASES:
+                connections[alias].close()
+                target = sqlite3.connect(
+                    connections[alias].settings_dict["NAME"])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f"Synced {alias}."))
+        finally:
+            source.close()
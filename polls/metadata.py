@@ -0,0 +1,143 @@
+"""Read-through cache of the questions and their choices.
+
+A question and its choices rarely change once published, so the poll
+pages read them from the cache. The cached copy leaves out the tallies
+(``Choice.votes`` and ``Question.tally_version``), which change with
+every vote; reading them on a cached object loads them fresh.
+
+The entries are dropped by the receivers in signals.py whenever a
+question or a choice is saved or deleted, admin edits included, and by
+the fixture loader.
+
+To keep a hot poll from sending every request to the database at once:
+
+* when an entry is missing, one request loads it while the others wait
+  up to LOCK_WAIT seconds for it;
+* when an entry gets close to its timeout, one request refreshes it
+  while the others keep reading the old one;
+* a missing question is cached for MISSING_TIMEOUT seconds only.
+"""
+
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .models import Choice, Question, now_and_on_commit
+from .routers import ReplicaRouter
+
+# Seconds a request loading an entry holds its lock.
+LOCK_TIMEOUT = 5
+
+# Longest a request waits for another one loading a missing entry,
+# and how often it looks, in seconds.
+LOCK_WAIT = 0.5
+POLL_INTERVAL = 0.01
+
+# Fraction of the timeout after which an entry is refreshed.
+REFRESH_AFTER = 0.9
+
+# Seconds a missing question stays cached, to spare the database a
+# stream of requests for it.
+MISSING_TIMEOUT = 5
+
+
+def _key(pk) -> str:
+    """Return the cache key of a question."""
+    return f"polls:question:{pk}"
+
+
+def _lock_key(pk) -> str:
+    """Return the cache key of the lock of a question's entry."""
+    return f"polls:question:{pk}:lock"
+
+
+def _questions(pk):
+    """Return the query of the question and its choices, without the
+    tallies.
+
+    It reads the primary: an entry loaded from a replica lagging behind
+    an edit would outlive the edit.
+    """
+    return Question.objects.using(ReplicaRouter.primary).only(
+        "question_text", "pub_date", "end_date"
+    ).prefetch_related(
+        Prefetch("choice_set",
+                 queryset=Choice.objects.using(ReplicaRouter.primary).only(
+                     "question", "choice_text").order_by("pk"))
+    ).filter(pk=pk)
+
+
+def _entry(question) -> tuple:
+    """Return the cache entry of a question, or of a missing one."""
+    if question is None:
+        timeout = MISSING_TIMEOUT
+    else:
+        timeout = settings.POLLS_METADATA_CACHE_TIMEOUT
+    return (time.time() + timeout * REFRESH_AFTER, question), timeout
+
+
+def _should_load(pk, entry) -> bool:
+    """Tell whether this request loads the entry, taking its lock."""
+    if entry is not None and entry[0] > time.time():
+        return False
+    return cache.add(_lock_key(pk), 1, LOCK_TIMEOUT)
+
+
+def get_question(pk):
+    """Return the question with its choices in a fixed order,
+    or None when it does not exist."""
+    deadline = time.monotonic() + LOCK_WAIT
+    entry = cache.get(_key(pk))
+    while not _should_load(pk, entry):
+        if entry is not None:
+            return entry[1]
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(_key(pk))
+    question = _questions(pk).first()
+    cache.set(_key(pk), *_entry(question))
+    cache.delete(_lock_key(pk))
+    return question
+
+
+async def _ashould_load(pk, entry) -> bool:
+    """Async version of _should_load()."""
+    if entry is not None and entry[0] > time.time():
+        return False
+    return await cache.aadd(_lock_key(pk), 1, LOCK_TIMEOUT)
+
+
+async def aget_question(pk):
+    """Async version of get_question()."""
+    deadline = time.monotonic() + LOCK_WAIT
+    entry = await cache.aget(_key(pk))
+    while not await _ashould_load(pk, entry):
+        if entry is not None:
+            return entry[1]
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+        entry = await cache.aget(_key(pk))
+    question = await _questions(pk).afirst()
+    await cache.aset(_key(pk), *_entry(question))
+    await cache.adelete(_lock_key(pk))
+    return question
+
+
+def find_choice(question, choice_id):
+    """Return the choice of the question with the id, as sent by
+    a form, raising Choice.DoesNotExist when there is none."""
+    for choice in question.choice_set.all():
+        if str(choice.pk) == str(choice_id):
+            return choice
+    raise Choice.DoesNotExist(f"No choice {choice_id!r} in the question.")
+
+
+def forget_questions(pks):
+    """Drop the cached questions."""
+    keys = [_key(pk) for pk in pks]
+    now_and_on_commit(lambda: cache.delete_many(keys))
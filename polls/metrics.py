@@ -0,0 +1,322 @@
+"""Timings of the requests, as Prometheus histograms by URL name.
+
+ServerTimingMiddleware measures every request and records it here.
+Each process keeps its histograms in memory. When POLLS_METRICS_DIR is
+set, it also writes them to a file of its own in that directory, at
+most every POLLS_METRICS_FLUSH_INTERVAL seconds and when it exits, and
+the /metrics page adds up the files of every process, like the
+multiprocess mode of prometheus_client. The files of the processes
+that exited are added to a file of their own, MERGED, and removed, so
+the totals never go back and the directory does not grow with every
+restart. The file of a process is named after its pid, which tells
+whether it is still running; on Windows, where that cannot be checked
+safely, the files are kept.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import throttle
+
+# Upper bounds of the buckets, in seconds or in queries.
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+QUERIES = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Help text and buckets of each histogram, labelled by URL name.
+HISTOGRAMS = {
+    "polls_view_duration_seconds": (
+        "Time spent producing the response.", SECONDS),
+    "polls_db_duration_seconds": (
+        "Time spent in database queries per request.", SECONDS),
+    "polls_db_queries": ("Database queries per request.", QUERIES),
+    "polls_template_duration_seconds": (
+        "Time spent rendering templates per request.", SECONDS),
+}
+
+# The admission counters of polls.throttle.
+ADMISSION = "polls_vote_admission_total"
+
+# File of the metrics of the processes that exited, and the lock taken
+# by the /metrics page while it adds them to it.
+MERGED = "merged.json"
+MERGE_LOCK = "merged.lock"
+
+# Seconds the lock is waited for, and after which it is left over by
+# a crash and broken.
+LOCK_WAIT = 1
+LOCK_STALE = 30
+POLL_INTERVAL = 0.01
+
+_lock = threading.Lock()
+_process = None
+
+
+class _ProcessMetrics:
+    """Histograms of the current process."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.name = f"{self.pid}-{time.time_ns()}.json"
+        # [bucket counts, sum] by (histogram, URL name); the last count
+        # is the +Inf bucket.
+        self.histograms = {}
+        self.flushed = 0.0
+
+    def observe(self, name: str, view: str, value: float):
+        buckets = HISTOGRAMS[name][1]
+        histogram = self.histograms.setdefault(
+            (name, view), [[0] * (len(buckets) + 1), 0])
+        histogram[0][next(
+            (i for i, bound in enumerate(buckets) if value <= bound),
+            len(buckets))] += 1
+        histogram[1] += value
+
+    def snapshot(self) -> dict:
+        return {
+            "histograms": [[name, view, counts, total] for (name, view),
+                           (counts, total) in self.histograms.items()],
+            "counters": {ADMISSION: dict(throttle.COUNTERS)},
+        }
+
+
+def _current() -> _ProcessMetrics:
+    """Return the metrics of this process, starting afresh after a
+    fork. Call with the lock held."""
+    global _process
+    if _process is None or _process.pid != os.getpid():
+        _process = _ProcessMetrics()
+    return _process
+
+
+def observe(view: str, timings: dict):
+    """Record the timings of a request to the view.
+
+    Args:
+        view: URL name of the view
+        timings: value of each histogram
+    """
+    with _lock:
+        process = _current()
+        for name, value in timings.items():
+            process.observe(name, view, value)
+    flush()
+
+
+def flush(force: bool = False):
+    """Write the metrics of this process to POLLS_METRICS_DIR, unless
+    they were written less than POLLS_METRICS_FLUSH_INTERVAL ago."""
+    directory = settings.POLLS_METRICS_DIR
+    with _lock:
+        if not directory or _process is None or _process.pid != os.getpid():
+            return
+        now = time.monotonic()
+        if not force and (
+                now - _process.flushed < settings.POLLS_METRICS_FLUSH_INTERVAL):
+            return
+        _process.flushed = now
+        data = json.dumps(_process.snapshot())
+        name = _process.name
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "w") as snapshot:
+        snapshot.write(data)
+    os.replace(path + ".tmp", path)
+
+
+atexit.register(flush, force=True)
+
+
+def _alive(pid: int) -> bool:
+    """Return whether the process may still be running."""
+    if os.name == "nt":
+        # os.kill() would terminate it.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _lock_directory(directory: str) -> bool:
+    """Take the merge lock of the directory, breaking a stale one.
+
+    Returns:
+        False when another process holds it for longer than LOCK_WAIT
+    """
+    path = os.path.join(directory, MERGE_LOCK)
+    deadline = time.monotonic() + LOCK_WAIT
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) > LOCK_STALE:
+                os.remove(path)
+                continue
+        except OSError:
+            continue
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+
+
+def _read(path: str):
+    """Return the snapshot in a file, or None when it cannot be read."""
+    try:
+        with open(path) as snapshot:
+            return json.load(snapshot)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path: str, data: dict):
+    """Replace a snapshot file in one step."""
+    with open(path + ".tmp", "w") as snapshot:
+        json.dump(data, snapshot)
+    os.replace(path + ".tmp", path)
+
+
+def _merge_dead(directory: str, own: str):
+    """Add the files of the processes that exited to MERGED and remove
+    them. Call with the merge lock held.
+
+    MERGED lists the files it covers until they are removed, so a
+    merge interrupted halfway never counts a file twice.
+    """
+    merged_path = os.path.join(directory, MERGED)
+    merged = _read(merged_path) or {"histograms": [], "counters": {}}
+    covered = set(merged.pop("files", []))
+    dead = []
+    for name in sorted(os.listdir(directory)):
+        pid = name.split("-", 1)[0]
+        if (name.endswith(".json") and name != own and pid.isdigit()
+                and name not in covered and not _alive(int(pid))):
+            dead.append(name)
+    if dead:
+        snapshots = [merged] + [
+            snapshot for snapshot in (
+                _read(os.path.join(directory, name)) for name in dead)
+            if snapshot is not None]
+        merged = _snapshot(_add(snapshots))
+        merged["files"] = dead
+        _write(merged_path, merged)
+    for name in covered | set(dead):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def _snapshots() -> list:
+    """Return the metrics of this process and those written by the
+    others, merging the files of the processes that exited first."""
+    with _lock:
+        process = _current()
+        snapshots = [process.snapshot()]
+    directory = settings.POLLS_METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+    locked = _lock_directory(directory)
+    try:
+        if locked:
+            _merge_dead(directory, process.name)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json") or name == process.name:
+                continue
+            snapshot = _read(os.path.join(directory, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    finally:
+        if locked:
+            os.remove(os.path.join(directory, MERGE_LOCK))
+    return snapshots
+
+
+def _add(snapshots) -> dict:
+    """Add up snapshots.
+
+    Returns:
+        [bucket counts, sum] by (histogram, URL name), and the
+        counters by name and outcome
+    """
+    histograms, counters = {}, {}
+    for snapshot in snapshots:
+        for name, view, counts, total in snapshot["histograms"]:
+            merged = histograms.setdefault(
+                (name, view), [[0] * len(counts), 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+        for name, values in snapshot["counters"].items():
+            for outcome, value in values.items():
+                counter = counters.setdefault(name, {})
+                counter[outcome] = counter.get(outcome, 0) + value
+    return {"histograms": histograms, "counters": counters}
+
+
+def _snapshot(metrics: dict) -> dict:
+    """Return added up metrics in the format of the snapshot files."""
+    return {
+        "histograms": [[name, view, counts, total] for (name, view),
+                       (counts, total) in metrics["histograms"].items()],
+        "counters": metrics["counters"],
+    }
+
+
+def collect() -> dict:
+    """Add up the metrics of all the processes.
+
+    Returns:
+        [bucket counts, sum] by (histogram, URL name), and the
+        counters by name and outcome
+    """
+    return _add(_snapshots())
+
+
+def _label(value: str) -> str:
+    """Escape a label value of the text format."""
+    return (value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def _histogram_lines(name: str, histograms: dict) -> list:
+    """Return the samples of one histogram, for every URL name."""
+    bounds = [str(bound) for bound in HISTOGRAMS[name][1]] + ["+Inf"]
+    lines = []
+    for (metric, view), (counts, total) in sorted(histograms.items()):
+        if metric != name:
+            continue
+        view = _label(view)
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{view="{view}"}} {total}')
+        lines.append(f'{name}_count{{view="{view}"}} {cumulative}')
+    return lines
+
+
+def text_format(metrics: dict) -> str:
+    """Return the metrics in the Prometheus text format."""
+    lines = []
+    for name, (help_text, _) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}",
+                  f"# TYPE {name} histogram"]
+        lines += _histogram_lines(name, metrics["histograms"])
+    lines += [f"# HELP {ADMISSION} Votes accepted, throttled and shed.",
+              f"# TYPE {ADMISSION} counter"]
+    for outcome, value in sorted(
+            metrics["counters"].get(ADMISSION, {}).items()):
+        lines.append(f'{ADMISSION}{{outcome="{_label(outcome)}"}} {value}')
+    return "\n".join(lines) + "\n"
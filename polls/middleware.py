@@ -0,0 +1,235 @@
+"""Middleware of the polls app."""
+
+import mimetypes
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from . import metrics
+from .assets import COMPRESSIBLE, ENCODINGS
+from .context import current_request, serving
+from .routers import has_written, start_request
+from .slowlog import log_slow_query
+
+# Cookie marking a client that wrote recently.
+PIN_COOKIE = "polls_primary"
+
+
+def accepted_codings(header: str) -> set:
+    """Return the content codings an Accept-Encoding header accepts."""
+    codings = set()
+    for item in header.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not any(re.fullmatch(r"q=0(\.0*)?", param) for param in params):
+            codings.add(coding.lower())
+    return codings
+
+
+class ReplicaPinMiddleware:
+    """Keeps a client on the primary database for a while after it
+    wrote, so that the page after a vote shows that vote even when the
+    replicas lag behind."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start_request(pinned=bool(request.COOKIES.get(PIN_COOKIE)))
+        return self.pin(self.get_response(request))
+
+    async def __acall__(self, request):
+        start_request(pinned=bool(request.COOKIES.get(PIN_COOKIE)))
+        return self.pin(await self.get_response(request))
+
+    @staticmethod
+    def pin(response):
+        """Mark the client as a recent writer."""
+        if has_written():
+            response.set_cookie(
+                PIN_COOKIE, "1",
+                max_age=settings.POLLS_REPLICA_PIN_SECONDS,
+                httponly=True, samesite="Lax")
+        return response
+
+
+class PrecompressedStaticMiddleware:
+    """Serves the files collected into STATIC_ROOT by
+    polls.storage.CompressedManifestStaticFilesStorage.
+
+    A client accepting Brotli or gzip gets the precompressed variant of
+    the file. Files with a hashed name never change, so they are cached
+    for a year without revalidation; others must be revalidated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = str(settings.STATIC_ROOT)
+        self.hashed = set(
+            getattr(staticfiles_storage, "hashed_files", {}).values())
+
+    def __call__(self, request):
+        if request.method in ("GET", "HEAD") and \
+                request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name: str):
+        """Return the response of a collected file, or None."""
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        encoding, served = None, path
+        accepted = accepted_codings(
+            request.headers.get("Accept-Encoding", ""))
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(path + suffix):
+                encoding, served = coding, path + suffix
+                break
+        mtime = os.stat(served).st_mtime
+        if not was_modified_since(
+                request.headers.get("If-Modified-Since"), mtime):
+            response = HttpResponseNotModified()
+        else:
+            content_type = mimetypes.guess_type(path)[0]
+            response = FileResponse(
+                open(served, "rb"),
+                content_type=content_type or "application/octet-stream")
+            # Named after the variant otherwise.
+            del response["Content-Disposition"]
+            if encoding:
+                response["Content-Encoding"] = encoding
+        response["Last-Modified"] = http_date(mtime)
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            response["Vary"] = "Accept-Encoding"
+        response["Cache-Control"] = (
+            "public, max-age=31536000, immutable" if name in self.hashed
+            else "public, no-cache")
+        return response
+
+
+class RequestTimer:
+    """Adds up the time a request spends in the database, through
+    time_query(), and in rendering templates."""
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def time_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection, adding the query to the
+    timer of the current request, if any."""
+    timer = getattr(current_request(), "polls_timer", None)
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """Install the execute wrappers of the polls on a new connection,
+    once (see polls.context)."""
+    # The slow query log goes first, outermost, so the EXPLAIN of a slow
+    # query is not timed. They go in front of the wrappers already
+    # installed: connection.execute_wrapper() pops the last one on exit,
+    # which must stay the one it pushed even when the connection opens
+    # inside it.
+    connection.execute_wrappers[:0] = [
+        wrapper for wrapper in (log_slow_query, time_query)
+        if wrapper not in connection.execute_wrappers]
+
+
+class ServerTimingMiddleware:
+    """Measures the time of each request spent in the database, in
+    rendering templates and in total, sends it in a Server-Timing
+    header and records it in polls.metrics by URL name. It also
+    installs the slow query log of polls.slowlog.
+
+    Templates are timed while a TemplateResponse renders; a template
+    rendered by the view itself counts in the total only.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.polls_timer = timer = RequestTimer()
+        started = time.perf_counter()
+        with serving(request):
+            response = self.get_response(request)
+        return self.finish(request, response, timer,
+                           time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        request.polls_timer = timer = RequestTimer()
+        started = time.perf_counter()
+        with serving(request):
+            response = await self.get_response(request)
+        return self.finish(request, response, timer,
+                           time.perf_counter() - started)
+
+    def process_template_response(self, request, response):
+        timer = request.polls_timer
+        started = time.perf_counter()
+
+        def rendered(response):
+            timer.template += time.perf_counter() - started
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def finish(request, response, timer: RequestTimer, total: float):
+        """Send and record the timings of the request."""
+        if settings.POLLS_SERVER_TIMING:
+            timings = ", ".join([
+                f'db;dur={timer.db * 1000:.1f};desc="{timer.queries} queries"',
+                f"tpl;dur={timer.template * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ])
+            if response.has_header("Server-Timing"):
+                timings = f"{response['Server-Timing']}, {timings}"
+            response["Server-Timing"] = timings
+        match = request.resolver_match
+        if match is not None:
+            metrics.observe(match.view_name, {
+                "polls_view_duration_seconds": total,
+                "polls_db_duration_seconds": timer.db,
+                "polls_db_queries": timer.queries,
+                "polls_template_duration_seconds": timer.template,
+            })
+        return response
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_votes(apps, schema_editor):
+    """Fill the new tally column from the existing votes."""
+    Choice = apps.get_model("polls", "Choice")
+    Vote = apps.get_model("polls", "Vote")
+    vote_count = Vote.objects.filter(
+        choice=OuterRef("pk")
+    ).order_by().values("choice").annotate(
+        total=Count("pk")
+    ).values("total")
+    Choice.objects.update(votes=Coalesce(Subquery(vote_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_vote_question(apps, schema_editor):
+    """Copy the question of each vote from its choice and drop the
+    duplicate votes, keeping the latest vote of each user and question.
+    """
+    Choice = apps.get_model("polls", "Choice")
+    Vote = apps.get_model("polls", "Vote")
+    Vote.objects.update(
+        question=Subquery(
+            Choice.objects.filter(pk=OuterRef("choice")).values("question")
+        )
+    )
+    duplicates = Vote.objects.order_by().values(
+        "user", "question"
+    ).annotate(total=Count("pk"), latest=Max("pk")).filter(total__gt=1)
+    for row in duplicates.iterator():
+        Vote.objects.filter(
+            user=row["user"], question=row["question"], pk__lt=row["latest"]
+        ).delete()
+    vote_count = Vote.objects.filter(
+        choice=OuterRef("pk")
+    ).order_by().values("choice").annotate(
+        total=Count("pk")
+    ).values("total")
+    Choice.objects.update(votes=Coalesce(Subquery(vote_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_question_pub_end_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(fill_vote_question, migrations.RunPython.noop),
+    ]
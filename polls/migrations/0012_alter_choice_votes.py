@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_question_tally_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='choice',
+            name='votes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -2,18 +2,105 @@
 
 import datetime
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import (Case, Count, F, OuterRef, Q, Subquery,
+                              Value, When)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .routers import ReplicaRouter
+
+
+def _day_bounds() -> tuple:
+    """Return the start of today and of tomorrow.
+
+    can_vote and is_published compare calendar dates of the aware
+    datetimes, so the same days are used for the queries.
+    """
+    today = datetime.datetime.combine(
+        timezone.now().date(), datetime.time.min,
+        tzinfo=datetime.timezone.utc)
+    return today, today + datetime.timedelta(days=1)
+
+
+class QuestionQuerySet(models.QuerySet):
+    """Queries on questions, with the poll status computed in SQL.
+
+    The conditions are plain range comparisons on pub_date and end_date
+    so the database can answer them from the (pub_date, end_date) index.
+    """
+
+    @staticmethod
+    def _status_conditions() -> dict:
+        """Return the condition of each status."""
+        today, tomorrow = _day_bounds()
+        scheduled = Q(pub_date__gte=tomorrow)
+        closed = Q(pub_date__lt=tomorrow, end_date__lt=today)
+        return {
+            Question.Status.SCHEDULED: scheduled,
+            Question.Status.CLOSED: closed,
+            Question.Status.OPEN: ~scheduled & ~closed,
+        }
+
+    def with_status(self):
+        """Annotate each question with its status."""
+        conditions = self._status_conditions()
+        return self.annotate(status=Case(
+            When(conditions[Question.Status.SCHEDULED],
+                 then=Value(Question.Status.SCHEDULED)),
+            When(conditions[Question.Status.CLOSED],
+                 then=Value(Question.Status.CLOSED)),
+            default=Value(Question.Status.OPEN),
+            output_field=models.CharField(),
+        ))
+
+    def with_status_in(self, status):
+        """Filter the questions on their status."""
+        return self.filter(self._status_conditions()[status])
+
+    def bump_tally_version(self) -> int:
+        """Mark the tallies of the questions as changed."""
+        return self.update(tally_version=F("tally_version") + 1)
+
 
 class Question(models.Model):
     """The question of the poll. Contains the text and publication date.
     """
+
+    class Status(models.TextChoices):
+        """Where the poll is in its lifetime.
+
+        A poll is scheduled until the day of its pub_date, then open
+        until the day of its end_date, then closed.
+        """
+        SCHEDULED = "scheduled"
+        OPEN = "open"
+        CLOSED = "closed"
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField("date published", default=timezone.now)
     end_date = models.DateTimeField(
         "date published", null=True, default=None, blank=True)
+    # Bumped whenever the tallies of the choices change, so anything
+    # derived from them can be cached under the version.
+    tally_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Backs the keyset pagination of the index page.
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="polls_question_pub_id_idx"),
+            # Backs the status filters and the pub_date__lte filters.
+            models.Index(
+                fields=["pub_date", "end_date"],
+                name="polls_question_pub_end_idx"),
+        ]
+
+    objects = QuestionQuerySet.as_manager()
 
     def __str__(self) -> str:
         """
@@ -21,6 +108,15 @@ class Question(models.Model):
         """
         return self.question_text
 
+    def current_status(self) -> str:
+        """Return the status of the poll, as with_status() does."""
+        today, tomorrow = _day_bounds()
+        if self.pub_date >= tomorrow:
+            return Question.Status.SCHEDULED
+        if self.end_date is not None and self.end_date < today:
+            return Question.Status.CLOSED
+        return Question.Status.OPEN
+
     def was_published_recently(self) -> bool:
         """check whether the question was published within 24 hours.
 
@@ -51,6 +147,50 @@ class Question(models.Model):
             return False
 
 
+class QuestionsVersionQuerySet(models.QuerySet):
+    """Queries on the version of the questions."""
+
+    def bump(self):
+        """Move the version on, creating its row the first time."""
+        if not self.filter(pk=1).update(version=F("version") + 1):
+            self.bulk_create([self.model(pk=1, version=1)],
+                             ignore_conflicts=True)
+
+
+class QuestionsVersion(models.Model):
+    """Version of the whole set of questions: one row, bumped whenever
+    a question is saved or deleted, which the ETag of the index covers.
+
+    It lives in the database rather than the cache, so every worker
+    process sees the edits made by the others.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = QuestionsVersionQuerySet.as_manager()
+
+
+class ChoiceQuerySet(models.QuerySet):
+    """Queries on choices."""
+
+    def recount(self) -> int:
+        """Rebuild the vote tally of every choice in the queryset
+        from the Vote table.
+
+        Returns:
+            the number of choices updated
+        """
+        vote_count = Vote.objects.filter(
+            choice=OuterRef("pk")
+        ).order_by().values("choice").annotate(
+            total=Count("pk")
+        ).values("total")
+        Question.objects.filter(
+            pk__in=self.values("question_id")
+        ).bump_tally_version()
+        return self.update(votes=Coalesce(Subquery(vote_count), 0))
+
+
 class Choice(models.Model):
     """
     It's the choice of the poll question.
@@ -58,12 +198,15 @@ class Choice(models.Model):
     """
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
-    # votes = models.IntegerField(default=0)
+    # Materialized tally of the Vote rows pointing at this choice.
+    # It is kept in step by VoteManager.record, and by the saves and
+    # deletions of votes, loaddata included (see polls/signals.py).
+    # Writes bypassing both, as bulk_create() or raw SQL, need it
+    # rebuilt with
+    # ``python manage.py recount``.
+    votes = models.PositiveIntegerField(default=0, editable=False)
 
-    @property
-    def votes(self) -> int:
-        """Return the number of votes"""
-        return self.vote_set.count()
+    objects = ChoiceQuerySet.as_manager()
 
     def __str__(self):
         """
@@ -72,8 +215,118 @@ class Choice(models.Model):
         return self.choice_text
 
 
+def now_and_on_commit(fn):
+    """Call ``fn`` now and again once the current transaction commits.
+
+    Used to drop cached values: one read by another request before the
+    commit would otherwise stay cached with the old data.
+    """
+    fn()
+    transaction.on_commit(fn)
+
+
+def _voted_key(user_id) -> str:
+    """Return the cache key of the voted map of a user."""
+    return f"polls:voted:{user_id}"
+
+
+class VoteManager(models.Manager):
+    """Write path of the votes, and the cached map of the choices
+    each user voted for."""
+
+    def voted_map(self, user) -> dict:
+        """Return the choice the user voted for in each question, as
+        {question id: choice id}, from the cache or in one query.
+
+        The map is kept on the user object for the rest of the request.
+        It is read from the primary: a map read from a replica lagging
+        behind a vote would outlive the vote in the cache.
+        """
+        voted = getattr(user, "_polls_voted", None)
+        if voted is None:
+            voted = cache.get(_voted_key(user.pk))
+            if voted is None:
+                voted = dict(self.using(ReplicaRouter.primary).filter(
+                    user=user).values_list("question_id", "choice_id"))
+                cache.set(_voted_key(user.pk), voted,
+                          settings.POLLS_VOTED_CACHE_TIMEOUT)
+            user._polls_voted = voted
+        return voted
+
+    async def avoted_map(self, user) -> dict:
+        """Async version of voted_map()."""
+        voted = getattr(user, "_polls_voted", None)
+        if voted is None:
+            voted = await cache.aget(_voted_key(user.pk))
+            if voted is None:
+                voted = {
+                    question_id: choice_id
+                    async for question_id, choice_id in self.using(
+                        ReplicaRouter.primary).filter(user=user).values_list(
+                        "question_id", "choice_id")
+                }
+                await cache.aset(_voted_key(user.pk), voted,
+                                 settings.POLLS_VOTED_CACHE_TIMEOUT)
+            user._polls_voted = voted
+        return voted
+
+    def forget_voted(self, user_ids):
+        """Drop the cached voted maps of the users."""
+        keys = [_voted_key(user_id) for user_id in user_ids]
+        now_and_on_commit(lambda: cache.delete_many(keys))
+
+    def record(self, user, choice):
+        """Save the vote of the user for the choice.
+
+        A user has one vote per question, so the vote is an upsert on
+        (user, question) that moves an existing vote to the new choice.
+        The tallies of the choices and the tally version of the question
+        are updated in the same transaction.
+
+        Returns:
+            the saved vote
+        """
+        tally = Choice.objects
+        vote = self.model(
+            user=user, question_id=choice.question_id, choice=choice)
+        with transaction.atomic():
+            # Guarded like signals.vote_deleted, so that a tally
+            # behind its votes cannot break the CHECK of the column.
+            tally.filter(
+                vote__user=user, vote__question_id=choice.question_id,
+                votes__gt=0,
+            ).update(votes=F("votes") - 1)
+            self.bulk_create(
+                [vote],
+                update_conflicts=True,
+                unique_fields=["user", "question"],
+                update_fields=["choice"],
+            )
+            tally.filter(pk=choice.pk).update(votes=F("votes") + 1)
+            Question.objects.filter(
+                pk=choice.question_id
+            ).bump_tally_version()
+            self.forget_voted([user.pk])
+        user.__dict__.pop("_polls_voted", None)
+        return vote
+
+
 class Vote(models.Model):
-    """A bote by a user for a choice in a poll"""
+    """A vote by a user for a choice in a poll.
+
+    The question is stored with the vote so the database can enforce
+    one vote per user and question.
+    """
 
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "question"],
+                name="polls_vote_one_per_question"),
+        ]
@@ -0,0 +1,100 @@
+"""Keyset (cursor) pagination for the polls index.
+
+The pages are sliced on the ``(pub_date, id)`` pair of the last row
+seen instead of an OFFSET, so every page costs the same index range
+scan no matter how deep the reader goes.
+"""
+
+import datetime
+
+from django.db.models import Q
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(question) -> str:
+    """Return the cursor pointing at the question."""
+    delta = question.pub_date - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f"{micros}-{question.pk}"
+
+
+def decode_cursor(cursor):
+    """Return the ``(pub_date, id)`` pair of the cursor,
+    or None when the cursor is missing or malformed."""
+    try:
+        micros, pk = cursor.rsplit("-", 1)
+        return (EPOCH + datetime.timedelta(microseconds=int(micros)),
+                int(pk))
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+class KeysetPage:
+    """One page of questions, newest first, with the cursors
+    of its neighbours."""
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        """Cursor of the last question on the page."""
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        """Cursor of the first question on the page."""
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+def _page_rows(queryset, per_page, after, before):
+    """Return the rows to fetch for a page (one more than the page
+    holds, to tell whether there is a page beyond it) and whether they
+    are read backwards from the ``before`` cursor."""
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+    if before is not None:
+        pub_date, pk = before
+        return queryset.filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+        ).order_by("pub_date", "pk")[:per_page + 1], True, False
+    if after is not None:
+        pub_date, pk = after
+        queryset = queryset.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+        )
+    return (queryset.order_by("-pub_date", "-pk")[:per_page + 1],
+            False, after is not None)
+
+
+def _make_page(rows, per_page, backwards, has_previous):
+    """Build the page from the fetched rows."""
+    if backwards:
+        return KeysetPage(rows[:per_page][::-1], True, len(rows) > per_page)
+    return KeysetPage(rows[:per_page], len(rows) > per_page, has_previous)
+
+
+def keyset_paginate(queryset, per_page, after=None, before=None):
+    """Return the page of the queryset that follows the ``after``
+    cursor, or precedes the ``before`` cursor.
+
+    Without a valid cursor the first page is returned.
+    """
+    rows, backwards, has_previous = _page_rows(
+        queryset, per_page, after, before)
+    return _make_page(list(rows), per_page, backwards, has_previous)
+
+
+async def akeyset_paginate(queryset, per_page, after=None, before=None):
+    """Async version of keyset_paginate()."""
+    rows, backwards, has_previous = _page_rows(
+        queryset, per_page, after, before)
+    return _make_page([row async for row in rows], per_page, backwards,
+                      has_previous)
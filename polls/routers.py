@@ -0,0 +1,67 @@
+"""Database router sending the reads of the polls app to replicas.
+
+The replicas are the aliases in ``POLLS_REPLICA_DATABASES``. Reads are
+spread over them at random, except when the current request is pinned to
+the primary: after it wrote anything itself, or when the client wrote
+recently (see polls.middleware.ReplicaPinMiddleware), so users always
+read their own votes.
+"""
+
+import contextvars
+import random
+
+from django.conf import settings
+
+_pinned = contextvars.ContextVar("polls_pinned_to_primary", default=False)
+_wrote = contextvars.ContextVar("polls_wrote", default=False)
+
+
+def start_request(pinned: bool):
+    """Reset the routing state at the start of a request."""
+    _pinned.set(pinned)
+    _wrote.set(False)
+
+
+def is_pinned_to_primary() -> bool:
+    """Whether the current request reads from the primary."""
+    return _pinned.get()
+
+
+def has_written() -> bool:
+    """Whether the current request wrote to the polls tables."""
+    return _wrote.get()
+
+
+class ReplicaRouter:
+    """Routes polls reads to the replicas and everything else to the
+    primary."""
+
+    app_label = "polls"
+    primary = "default"
+
+    def __init__(self):
+        self.replicas = list(settings.POLLS_REPLICA_DATABASES)
+
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label != self.app_label or not self.replicas
+                or is_pinned_to_primary()):
+            return None
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            _pinned.set(True)
+            _wrote.set(True)
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {self.primary, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas are copies of the primary, see sync_replicas.
+        if db in self.replicas:
+            return False
+        return None
@@ -0,0 +1,57 @@
+"""Receivers keeping the tallies and the caches of the polls in step
+with the edits of the models, wherever they are made: views, admin,
+shell or management commands. Connected by PollsConfig.ready()."""
+
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metadata import forget_questions
+from .models import Choice, Question, QuestionsVersion, Vote
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Rebuild the cached results and metadata of the question of an
+    edited choice."""
+    Question.objects.filter(pk=instance.question_id).bump_tally_version()
+    forget_questions([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Drop the cached metadata of an edited question and change the
+    validator of the index."""
+    forget_questions([instance.pk])
+    QuestionsVersion.objects.bump()
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def vote_changed(sender, instance, **kwargs):
+    """Drop the cached voted map of the user of an edited vote."""
+    Vote.objects.forget_voted([instance.user_id])
+
+
+@receiver(post_save, sender=Vote)
+def vote_saved(sender, instance, **kwargs):
+    """Recount the choices of the question of a vote saved outside
+    VoteManager.record, by create(), save() or loaddata. The previous
+    choice of a moved vote is unknown, so the whole question is
+    recounted."""
+    Choice.objects.filter(question_id=instance.question_id).recount()
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted(sender, instance, origin=None, **kwargs):
+    """Take a deleted vote off the tally of its choice, unless the
+    choice is deleted along with it."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model in (Question, Choice):
+        return
+    Choice.objects.filter(
+        pk=instance.choice_id, votes__gt=0
+    ).update(votes=F("votes") - 1)
+    Question.objects.filter(pk=instance.question_id).bump_tally_version()
@@ -0,0 +1,141 @@
+"""Log of the slow SQL queries, opt-in with POLLS_SLOW_QUERY_MS.
+
+Every query taking at least POLLS_SLOW_QUERY_MS milliseconds is logged
+to the ``polls.slow_queries`` logger (slow_queries.log) with the view
+and the line of the project that ran it. On SQLite the entry also has
+the EXPLAIN QUERY PLAN of the query and names the tables it reads in
+full, such as a scan of polls_vote missing an index.
+
+The queries run outside a request are logged too, as "no request".
+At most POLLS_SLOW_QUERY_LOG_LIMIT entries are written per minute and
+process; the entries left out are counted in the next one.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+
+from .context import current_request
+
+logger = logging.getLogger("polls.slow_queries")
+
+# Tables read in full, as opposed to through an index.
+FULL_SCAN = re.compile(r"SCAN (?:TABLE )?(\w+)$")
+
+# Frames of these files are not where a query comes from.
+_HOOKS = {os.path.abspath(__file__),
+          os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "middleware.py")}
+
+_lock = threading.Lock()
+_window = {"start": 0.0, "logged": 0, "suppressed": 0}
+
+
+def _admit() -> int:
+    """Count an entry in the current minute.
+
+    Returns:
+        the entries suppressed since the last one written,
+        or -1 when this one is suppressed as well
+    """
+    now = time.monotonic()
+    with _lock:
+        if now - _window["start"] >= 60:
+            _window.update(start=now, logged=0)
+        if _window["logged"] >= settings.POLLS_SLOW_QUERY_LOG_LIMIT:
+            _window["suppressed"] += 1
+            return -1
+        _window["logged"] += 1
+        suppressed, _window["suppressed"] = _window["suppressed"], 0
+        return suppressed
+
+
+def code_location() -> str:
+    """Return the innermost line of the project on the call stack."""
+    root = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(root) and filename not in _HOOKS
+                and "site-packages" not in filename):
+            path = os.path.relpath(filename, root)
+            return f"{path}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+def explain(connection, sql: str, params) -> tuple:
+    """Return the SQLite query plan of a query, as indented lines,
+    and the tables it reads in full."""
+    # A cursor of its own, so the wrappers of the connection do not
+    # see the EXPLAIN.
+    cursor = connection.connection.cursor(factory=SQLiteCursorWrapper)
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    depth, lines, scans = {0: -1}, [], []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+        match = FULL_SCAN.match(detail)
+        if match:
+            scans.append(match.group(1))
+    return lines, scans
+
+
+def _where(request) -> str:
+    """Return the view, or the path, of the request running a query."""
+    if request is None:
+        return "no request"
+    match = request.resolver_match
+    name = match.view_name if match is not None else request.path
+    return f"{request.method} {name}"
+
+
+def report(connection, sql: str, params, many: bool, duration: float,
+           request=None):
+    """Log a slow query, unless the limit of the minute is reached."""
+    suppressed = _admit()
+    if suppressed < 0:
+        return
+    lines = [
+        f"{duration * 1000:.1f} ms in {_where(request)} "
+        f"at {code_location()}",
+        sql,
+    ]
+    if (connection.vendor == "sqlite" and not many
+            and settings.POLLS_SLOW_QUERY_EXPLAIN):
+        try:
+            plan, scans = explain(connection, sql, params)
+        except sqlite3.Error as error:
+            plan, scans = [f"unavailable: {error}"], []
+        lines.append("Query plan:")
+        lines.extend(f"  {line}" for line in plan)
+        if scans:
+            lines.append(f"Full scans: {', '.join(scans)}")
+    if suppressed:
+        lines.append(f"({suppressed} slow queries not logged before this "
+                     "one)")
+    logger.warning("Slow query: %s", "\n".join(lines))
+
+
+def log_slow_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection reporting the query when it
+    is slow, with the current request (see polls.context)."""
+    threshold = settings.POLLS_SLOW_QUERY_MS
+    if not threshold:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+    if duration * 1000 >= threshold:
+        report(context["connection"], sql, params, many, duration,
+               current_request())
+    return result
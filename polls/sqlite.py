@@ -0,0 +1,21 @@
+"""Tuning of the SQLite connections.
+
+``SQLITE_PRAGMAS`` in the settings lists the PRAGMA statements run on
+every new SQLite connection, for example WAL journaling and a busy
+timeout for the production profile. It is empty by default.
+"""
+
+from django.conf import settings
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """Run the configured PRAGMAs on a new SQLite connection.
+
+    Connected to the connection_created signal in PollsConfig.ready().
+    """
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
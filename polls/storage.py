@@ -0,0 +1,20 @@
+"""Static files storage of the production build."""
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+from .assets import write_variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Hashed file names, plus the build steps of polls.assets.
+
+    After ``collectstatic`` has hashed the files, the text files get
+    gzip and Brotli variants, which PrecompressedStaticMiddleware serves.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            write_variants(self.path(name))
@@ -0,0 +1,30 @@
+"""Template tags of the polls assets."""
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+register = template.Library()
+
+BOOTSTRAP_VERSION = "5.3.3"
+BOOTSTRAP_CDN = f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist"
+
+# Static path, CDN path and Subresource Integrity hash of each file.
+# The files ship in polls/static; ``manage.py vendor_bootstrap``
+# downloads them again after a change of BOOTSTRAP_VERSION.
+BOOTSTRAP_FILES = {
+    "css": ("polls/vendor/bootstrap/bootstrap.min.css",
+            "css/bootstrap.min.css",
+            "sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH"),
+    "js": ("polls/vendor/bootstrap/bootstrap.bundle.min.js",
+           "js/bootstrap.bundle.min.js",
+           "sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz"),
+}
+
+
+@register.simple_tag
+def bootstrap():
+    """Load Bootstrap from the static files."""
+    return format_html(
+        '<script src="{}"></script>\n<link href="{}" rel="stylesheet">',
+        static(BOOTSTRAP_FILES["js"][0]), static(BOOTSTRAP_FILES["css"][0]))
@@ -1,14 +1,57 @@
 from mysite import settings
-from polls.models import Question, Choice
+from polls.models import Question, QuestionsVersion, Choice, Vote
+from polls.ingest import VoteBuffer, submit_vote
+from polls.loader import iter_json_array
+from polls.log import QueueListenerHandler, SampleFilter
+from polls.live import TallyBroadcaster
+from polls import assets, hashers, metadata, metrics, slowlog, throttle
+from polls.templatetags import polls_assets
+from polls.middleware import (PIN_COOKIE, PrecompressedStaticMiddleware,
+                              ReplicaPinMiddleware, instrument_connection,
+                              log_slow_query, time_query)
+from polls.pagination import decode_cursor, encode_cursor
+from polls.routers import ReplicaRouter, is_pinned_to_primary
+from django.http import HttpResponse
+from django.test import RequestFactory
+from asgiref.sync import sync_to_async
+from django.urls import include, path
+from polls import async_views, views as sync_views
 from django.contrib.auth.models import User
+import asyncio
+import django.db
 import django.test
 import datetime
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import json
+import logging
+import logging.config
+from logging.handlers import BufferingHandler
 
-from django.test import TestCase
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
 from django.utils import timezone
 from django.urls import reverse
 from mysite import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher)
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, transaction
 
 
 def create_question(question_text, days):
@@ -286,6 +329,2003 @@ class QuestionResultsViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class QuestionStatusTests(TestCase):
+    """Tests the poll status computed by the database"""
+
+    def setUp(self):
+        now = timezone.now()
+        day = datetime.timedelta(days=1)
+        self.questions = [
+            Question.objects.create(question_text=text, pub_date=pub_date,
+                                    end_date=end_date)
+            for text, pub_date, end_date in [
+                ("No end", now - day, None),
+                ("Running", now - day, now + day),
+                ("Ends today", now - day, now),
+                ("Ended", now - 10 * day, now - 5 * day),
+                ("Future", now + 10 * day, now + 20 * day),
+            ]
+        ]
+
+    def test_status_matches_model_methods(self):
+        """The annotated status agrees with is_published and can_vote."""
+        for question in Question.objects.with_status():
+            if not question.is_published():
+                expected = Question.Status.SCHEDULED
+            elif question.can_vote():
+                expected = Question.Status.OPEN
+            else:
+                expected = Question.Status.CLOSED
+            self.assertEqual(question.status, expected, question)
+
+    def test_filter_by_status(self):
+        """with_status_in selects the same questions as the annotation."""
+        annotated = Question.objects.with_status()
+        for status in Question.Status.values:
+            self.assertQuerySetEqual(
+                Question.objects.with_status_in(status).order_by("pk"),
+                annotated.filter(status=status).order_by("pk"),
+            )
+
+    def test_index_open_polls_only(self):
+        """The index can list the open polls only."""
+        response = self.client.get(
+            reverse("polls:index"), {"status": "open"})
+        self.assertEqual(
+            {q.question_text for q in response.context["latest_question_list"]},
+            {"No end", "Running", "Ends today"},
+        )
+
+
+@override_settings(POLLS_PAGE_SIZE=2)
+class IndexPaginationTests(TestCase):
+    """Tests the keyset pagination of the index page"""
+
+    def setUp(self):
+        self.questions = [
+            create_question(question_text=f"Question {n}", days=-n)
+            for n in range(1, 6)
+        ]
+
+    def test_first_page(self):
+        """The first page holds the newest questions."""
+        response = self.client.get(reverse("polls:index"))
+        self.assertQuerySetEqual(
+            response.context["latest_question_list"],
+            self.questions[:2],
+        )
+        self.assertFalse(response.context["page"].has_previous)
+        self.assertTrue(response.context["page"].has_next)
+
+    def test_walk_forward_and_back(self):
+        """The next and previous cursors walk the pages in order."""
+        url = reverse("polls:index")
+        page = self.client.get(url).context["page"]
+        page = self.client.get(
+            url, {"after": page.next_cursor}).context["page"]
+        self.assertEqual(page.object_list, self.questions[2:4])
+        page = self.client.get(
+            url, {"after": page.next_cursor}).context["page"]
+        self.assertEqual(page.object_list, self.questions[4:])
+        self.assertFalse(page.has_next)
+        page = self.client.get(
+            url, {"before": page.previous_cursor}).context["page"]
+        self.assertEqual(page.object_list, self.questions[2:4])
+        self.assertTrue(page.has_previous)
+
+    def test_cursor_before_1970(self):
+        """The cursor of a question published before 1970 reads back."""
+        question = Question.objects.create(
+            question_text="Moon landing",
+            pub_date=datetime.datetime(1969, 7, 20, 20, 17, 40, 5,
+                                       tzinfo=datetime.timezone.utc))
+        self.assertEqual(decode_cursor(encode_cursor(question)),
+                         (question.pub_date, question.pk))
+
+    def test_malformed_cursor(self):
+        """A malformed cursor shows the first page."""
+        response = self.client.get(reverse("polls:index"), {"after": "x-y"})
+        self.assertEqual(
+            response.context["latest_question_list"], self.questions[:2])
+
+
+class VoteTallyTests(TestCase):
+    """Tests the materialized vote tally of the choices"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Tally", days=-1)
+        self.first = Choice.objects.create(
+            question=self.question, choice_text="First")
+        self.second = Choice.objects.create(
+            question=self.question, choice_text="Second")
+        self.user = User.objects.create_user(
+            username="voter", password="FatChance!")
+
+    def test_vote_increments_tally(self):
+        """A new vote adds one to the tally of its choice."""
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("polls:vote", args=[self.question.id]),
+            {"choice": self.first.id})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    def test_changed_vote_moves_tally(self):
+        """Voting again moves the vote to the new choice."""
+        Vote.objects.record(self.user, self.first)
+        Vote.objects.record(self.user, self.second)
+        Vote.objects.record(self.user, self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(self.second.votes, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_one_vote_per_question(self):
+        """The database rejects a second vote on the same question."""
+        Vote.objects.record(self.user, self.first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(
+                user=self.user, question=self.question, choice=self.second)
+
+    def test_deleted_vote_decrements_tally(self):
+        """Deleting a vote, or its user, takes it off the tally."""
+        other = User.objects.create_user(username="other")
+        Vote.objects.record(self.user, self.first)
+        Vote.objects.record(other, self.first)
+        version = Question.objects.get(pk=self.question.pk).tally_version
+        Vote.objects.get(user=self.user).delete()
+        other.delete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(
+            Question.objects.get(pk=self.question.pk).tally_version,
+            version + 2)
+
+    def test_receivers_connected_without_views(self):
+        """The tally and cache receivers are connected when the app
+        loads, as in the shell, not when the URLconf imports the
+        views."""
+        script = (
+            "import sys, django; django.setup()\n"
+            "from django.db.models.signals import post_delete\n"
+            "from polls.models import Vote\n"
+            "print('polls.views' in sys.modules,"
+            " post_delete.has_listeners(Vote))\n")
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "mysite.settings"},
+            check=True).stdout
+        self.assertEqual(output.split(), ["False", "True"])
+
+    def test_deleted_question_skips_tally(self):
+        """The votes deleted with their choices leave the tallies
+        alone."""
+        Vote.objects.record(self.user, self.first)
+        with CaptureQueriesContext(connection) as queries:
+            self.question.delete()
+        self.assertFalse(any(
+            query["sql"].startswith('UPDATE "polls_choice"')
+            for query in queries))
+
+    def test_recount_rebuilds_tally(self):
+        """The recount command rebuilds tallies from the votes."""
+        Vote.objects.create(
+            user=self.user, question=self.question, choice=self.second)
+        Choice.objects.filter(pk=self.first.pk).update(votes=7)
+        call_command("recount", stdout=io.StringIO())
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(self.second.votes, 1)
+
+    def test_saved_vote_counted(self):
+        """A vote created or moved with save() is on the tallies."""
+        vote = Vote.objects.create(
+            user=self.user, question=self.question, choice=self.first)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+        vote.choice = self.second
+        vote.save()
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (0, 1))
+
+    def test_loaded_votes_counted(self):
+        """Votes loaded from a fixture are on the tallies."""
+        fixture = os.path.join(tempfile.mkdtemp(), "votes.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(fixture))
+        with open(fixture, "w") as fixture_file:
+            json.dump([{"model": "polls.vote", "pk": 1, "fields": {
+                "question": self.question.pk, "choice": self.first.pk,
+                "user": self.user.pk}}], fixture_file)
+        call_command("loaddata", fixture, verbosity=0)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+        Vote.objects.record(self.user, self.second)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+
+    def test_revote_on_drifted_tally(self):
+        """Moving a vote off a tally already at zero keeps it at zero."""
+        Vote.objects.record(self.user, self.first)
+        Choice.objects.filter(pk=self.first.pk).update(votes=0)
+        Vote.objects.record(self.user, self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (0, 1))
+
+    def test_results_queries_do_not_grow_with_votes(self):
+        """The results page costs the same number of queries
+        however many votes were cast: the ETag, the tally version
+        and the choices."""
+        url = reverse("polls:results", args=[self.question.id])
+        self.client.get(url)
+        Vote.objects.record(
+            User.objects.create_user(username="first"), self.first)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        for n in range(4):
+            voter = User.objects.create_user(username=f"voter{n}")
+            Vote.objects.record(voter, self.first)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(
+            response, f'<th id="votes-{self.first.id}">5</th>')
+
+
+class ResultsCacheTests(TestCase):
+    """Tests the cached results table"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="voter")
+
+    def test_vote_refreshes_results(self):
+        """A vote bumps the tally version, so the table is rebuilt."""
+        question = create_question(question_text="Cached", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="A")
+        url = reverse("polls:results", args=[question.id])
+        cell = f'<th id="votes-{choice.id}">'
+        self.assertContains(self.client.get(url), f"{cell}0</th>")
+        Vote.objects.record(self.user, choice)
+        self.assertContains(self.client.get(url), f"{cell}1</th>")
+
+    def test_choice_edit_refreshes_results(self):
+        """Editing a choice rebuilds the table."""
+        question = create_question(question_text="Cached", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="A")
+        url = reverse("polls:results", args=[question.id])
+        self.client.get(url)
+        choice.choice_text = "Renamed"
+        choice.save()
+        self.assertContains(self.client.get(url), "Renamed")
+
+    def test_closed_poll_cached_forever(self):
+        """The table of a closed poll is cached without a timeout."""
+        question = Question.objects.create(
+            question_text="Closed",
+            pub_date=timezone.now() - datetime.timedelta(days=10),
+            end_date=timezone.now() - datetime.timedelta(days=5))
+        response = self.client.get(
+            reverse("polls:results", args=[question.id]))
+        self.assertIsNone(response.context["results_cache_timeout"])
+
+
+class ConditionalGetTests(TestCase):
+    """Tests the ETags of the polls pages"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Cached", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text="A")
+        self.user = User.objects.create_user(username="voter")
+
+    def assertNotModified(self, url):
+        """Assert that revalidating the page answers 304 without
+        running the view."""
+        # The first visit sets the CSRF cookie the validator covers.
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_index_not_modified(self):
+        """The index answers 304 until a poll is published."""
+        url = reverse("polls:index")
+        etag = self.assertNotModified(url)
+        create_question(question_text="New", days=-1)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_etag_does_not_count(self):
+        """Revalidating the index reads the latest publication date
+        only, whatever the number of polls, and a deletion still
+        changes the ETag."""
+        url = reverse("polls:index")
+        etag = self.assertNotModified(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, headers={"if-none-match": etag})
+        self.assertNotIn("COUNT(", queries[0]["sql"])
+        create_question(question_text="Older", days=-2).delete()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_etag_follows_edits(self):
+        """Editing or closing a poll changes the ETag of the index."""
+        url = reverse("polls:index")
+        etag = self.assertNotModified(url)
+        self.question.end_date = timezone.now()
+        self.question.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.question.question_text = "Edited"
+        self.question.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_etag_shared_by_processes(self):
+        """An edit seen through the database alone, as made by another
+        process with a cache of its own, changes the ETag of the index."""
+        url = reverse("polls:index")
+        etag = self.assertNotModified(url)
+        QuestionsVersion.objects.bump()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_results_not_modified(self):
+        """The results answer 304 until a vote lands."""
+        url = reverse("polls:results", args=[self.question.id])
+        etag = self.assertNotModified(url)
+        Vote.objects.record(self.user, self.choice)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_not_modified(self):
+        """The detail page answers 304 until it changes."""
+        self.assertNotModified(
+            reverse("polls:detail", args=[self.question.id]))
+
+    def test_detail_per_user(self):
+        """The detail page validator differs between users."""
+        url = reverse("polls:detail", args=[self.question.id])
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.user)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_message_has_no_etag(self):
+        """A page showing a message is always rendered."""
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("polls:vote", args=[self.question.id]),
+            {"choice": self.choice.id}, follow=True)
+        self.assertContains(response, "Your vote has been saved!")
+        self.assertFalse(response.has_header("ETag"))
+
+
+class LiveResultsTests(TestCase):
+    """Tests the live tallies of the results page"""
+
+    def setUp(self):
+        self.question = create_question(question_text="Live", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question,
+                                  choice_text=f"Choice {n}")
+            for n in range(2)
+        ]
+        self.user = User.objects.create_user(username="voter")
+
+    def test_snapshot_without_asgi(self):
+        """Without ASGI the stream sends the current tallies once."""
+        Vote.objects.record(self.user, self.choices[0])
+        response = self.client.get(
+            reverse("polls:results_stream", args=[self.question.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("event: tally\n", content)
+        self.assertIn(
+            f'"{self.choices[0].id}": 1, "{self.choices[1].id}": 0',
+            content)
+
+    def test_snapshot_retry(self):
+        """Without ASGI the browser waits long before asking again."""
+        response = self.client.get(
+            reverse("polls:results_stream", args=[self.question.id]))
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith("retry: 60000\n"))
+
+    def test_no_stream_without_asgi(self):
+        """Without ASGI the results page does not open the stream."""
+        response = self.client.get(
+            reverse("polls:results", args=[self.question.id]))
+        self.assertNotContains(response, "EventSource")
+
+    async def test_stream_with_asgi(self):
+        """Under ASGI the results page opens the stream."""
+        response = await self.async_client.get(
+            reverse("polls:results", args=[self.question.id]))
+        self.assertContains(response, "EventSource")
+
+    def test_missing_question(self):
+        """There is no stream for a missing question."""
+        response = self.client.get(reverse("polls:results_stream", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_broadcast_deltas(self):
+        """Subscribers get every tally first, then only the changes."""
+        broadcaster = TallyBroadcaster(interval=0.01)
+        updates = broadcaster.listen(self.question.id)
+        self.assertEqual(
+            await anext(updates),
+            {self.choices[0].id: 0, self.choices[1].id: 0})
+        await sync_to_async(Vote.objects.record)(self.user, self.choices[1])
+        self.assertEqual(await anext(updates), {self.choices[1].id: 1})
+        await updates.aclose()
+        self.assertEqual(broadcaster.channels, {})
+
+    async def test_keepalive_releases_channel(self):
+        """A subscriber parked on a keepalive does not hold up the
+        others."""
+        broadcaster = TallyBroadcaster(interval=0.01)
+        parked = broadcaster.listen(self.question.id)
+        with mock.patch("polls.live.KEEPALIVE", 0.05):
+            await anext(parked)
+            self.assertIsNone(await anext(parked))
+        channel = broadcaster.channels[self.question.id]
+        self.assertFalse(channel.changed.locked())
+        other = broadcaster.listen(self.question.id)
+        await anext(other)
+        await sync_to_async(Vote.objects.record)(self.user, self.choices[1])
+        self.assertEqual(await asyncio.wait_for(anext(other), 1),
+                         {self.choices[1].id: 1})
+        await other.aclose()
+        await parked.aclose()
+
+
+class VoteBufferTests(TestCase):
+    """Tests the write-behind vote buffer"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Buffered", days=-1)
+        self.first = Choice.objects.create(
+            question=self.question, choice_text="First")
+        self.second = Choice.objects.create(
+            question=self.question, choice_text="Second")
+        self.user = User.objects.create_user(username="voter")
+        self.buffer = VoteBuffer(
+            max_size=2, max_staleness=0.05, flush_batch=10)
+
+    def test_flush_coalesces_votes(self):
+        """Only the last queued vote of a user on a question is saved."""
+        self.buffer.submit(self.user.pk, self.question.pk, self.first.pk)
+        self.buffer.submit(self.user.pk, self.question.pk, self.second.pk)
+        self.assertEqual(self.buffer.flush(), 1)
+        vote = Vote.objects.get()
+        self.assertEqual(vote.choice, self.second)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.votes, 1)
+
+    def test_flush_moves_existing_vote(self):
+        """A buffered vote replaces the saved vote and its tally."""
+        Vote.objects.record(self.user, self.first)
+        self.buffer.submit(self.user.pk, self.question.pk, self.second.pk)
+        self.buffer.flush()
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (0, 1))
+
+    def test_flush_moves_vote_off_drifted_tally(self):
+        """Moving a vote off a tally behind its votes keeps it at zero
+        instead of losing the vote."""
+        Vote.objects.record(self.user, self.first)
+        Choice.objects.filter(pk=self.first.pk).update(votes=0)
+        self.buffer.submit(self.user.pk, self.question.pk, self.second.pk)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get().choice, self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (0, 1))
+
+    def test_flush_large_batch(self):
+        """A batch larger than a chunk is saved with the right tallies."""
+        users = User.objects.bulk_create(
+            [User(username=f"bulk{n}") for n in range(1200)])
+        for user in users:
+            Vote.objects.create(user=user, question=self.question,
+                                choice=self.first)
+        Choice.objects.filter(pk=self.first.pk).update(votes=1200)
+        buffer = VoteBuffer(max_size=1200, max_staleness=0.05,
+                            flush_batch=10)
+        for n, user in enumerate(users):
+            choice = self.second if n < 700 else self.first
+            buffer.submit(user.pk, self.question.pk, choice.pk)
+        self.assertEqual(buffer.flush(), 1200)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (500, 700))
+
+    def test_failed_batch_saved_one_by_one(self):
+        """A vote that cannot be saved does not lose the others."""
+        other = User.objects.create_user(username="other")
+        self.buffer.submit(self.user.pk, self.question.pk, self.first.pk)
+        self.buffer.submit(other.pk, self.question.pk, None)
+        with self.assertLogs("polls.ingest", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get().user, self.user)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    def test_full_buffer_rejects(self):
+        """A full buffer refuses the vote."""
+        for _ in range(2):
+            self.assertTrue(self.buffer.submit(1, 1, 1))
+        self.assertFalse(self.buffer.submit(1, 1, 1))
+
+    @override_settings(POLLS_VOTE_INGEST="buffered")
+    def test_full_buffer_vote_wins(self):
+        """A vote written because the buffer is full is not overwritten
+        by an older vote of the user still queued."""
+        other = User.objects.create_user(username="other")
+        self.buffer.submit(self.user.pk, self.question.pk, self.first.pk)
+        self.buffer.submit(other.pk, self.question.pk, self.first.pk)
+        with mock.patch("polls.ingest.get_vote_buffer",
+                        return_value=self.buffer):
+            submit_vote(self.user, self.second)
+        self.assertEqual(Vote.objects.get(user=self.user).choice, self.second)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get(user=self.user).choice, self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (1, 1))
+        self.assertEqual(self.buffer._latest, {})
+
+    @override_settings(POLLS_VOTE_INGEST="buffered")
+    def test_vote_view_uses_buffer(self):
+        """The vote view queues the vote and keeps its redirect."""
+        self.client.force_login(self.user)
+        with mock.patch("polls.ingest.get_vote_buffer",
+                        return_value=self.buffer):
+            response = self.client.post(
+                reverse("polls:vote", args=[self.question.id]),
+                {"choice": self.first.id})
+        self.assertRedirects(
+            response, reverse("polls:results", args=[self.question.id]))
+        self.assertFalse(Vote.objects.exists())
+        self.buffer.flush()
+        self.assertTrue(Vote.objects.filter(user=self.user).exists())
+
+
+class VoteFlusherTests(TransactionTestCase):
+    """Tests the flusher thread of the vote buffer"""
+
+    def test_stop_flushes_pending_votes(self):
+        """Votes queued before shutdown are written."""
+        question = create_question(question_text="Flusher", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="A")
+        users = [User.objects.create_user(username=f"voter{n}")
+                 for n in range(3)]
+        buffer = VoteBuffer(max_size=10, max_staleness=0.05, flush_batch=2)
+        buffer.start()
+        for user in users:
+            buffer.submit(user.pk, question.pk, choice.pk)
+        buffer.stop()
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 3)
+
+
+@override_settings(POLLS_REPLICA_DATABASES=["replica0", "replica1"])
+class ReplicaRouterTests(TestCase):
+    """Tests the routing of reads to the replicas"""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaPinMiddleware(self.view)
+        self.wrote = False
+
+    def view(self, request):
+        """Stand-in view recording where the reads go."""
+        if self.wrote:
+            self.router.db_for_write(Vote)
+        self.read_from = self.router.db_for_read(Question)
+        return HttpResponse()
+
+    def test_polls_reads_go_to_replicas(self):
+        """Polls reads go to a replica, other apps to the primary."""
+        self.middleware(RequestFactory().get("/"))
+        self.assertIn(self.read_from, ["replica0", "replica1"])
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_read_your_writes(self):
+        """After a write, the request and the client's next requests
+        read from the primary."""
+        self.wrote = True
+        response = self.middleware(RequestFactory().post("/"))
+        self.assertIsNone(self.read_from)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.wrote = False
+        request = RequestFactory().get("/")
+        request.COOKIES[PIN_COOKIE] = "1"
+        self.middleware(request)
+        self.assertIsNone(self.read_from)
+        self.middleware(RequestFactory().get("/"))
+        self.assertFalse(is_pinned_to_primary())
+
+    def test_no_migrations_on_replicas(self):
+        """The replicas are never migrated."""
+        self.assertIs(self.router.allow_migrate("replica0", "polls"), False)
+        self.assertIsNone(self.router.allow_migrate("default", "polls"))
+
+
+@override_settings(
+    POLLS_REPLICA_DATABASES=["replica0"],
+    DATABASE_ROUTERS=["polls.routers.ReplicaRouter"],
+    MIDDLEWARE=settings.MIDDLEWARE + ["polls.middleware.ReplicaPinMiddleware"],
+)
+class ReplicaFileTests(TransactionTestCase):
+    """Tests the reads from a replica kept in a second SQLite file"""
+
+    # Every database when the class is set up, the replica included.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        django.db.connections.settings["replica0"] = {
+            **django.db.connections.settings["default"],
+            "NAME": os.path.join(cls.directory, "replica.sqlite3"),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        django.db.connections["replica0"].close()
+        del django.db.connections["replica0"]
+        del django.db.connections.settings["replica0"]
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Synced", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text="Yes")
+        call_command("sync_replicas", stdout=io.StringIO())
+
+    def test_reads_lag_until_synced(self):
+        """The index shows a new poll once the replica is synced."""
+        create_question(question_text="Fresh", days=-1)
+        url = reverse("polls:index")
+        self.assertNotContains(self.client.get(url), "Fresh")
+        call_command("sync_replicas", stdout=io.StringIO())
+        self.assertContains(self.client.get(url), "Fresh")
+
+    def test_vote_read_from_primary(self):
+        """After a vote the client reads its vote from the primary,
+        while the others read the replica."""
+        self.client.force_login(User.objects.create_user(username="voter"))
+        response = self.client.post(
+            reverse("polls:vote", args=[self.question.id]),
+            {"choice": self.choice.id})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.client.get(response.url).context[
+            "choices"][0].votes, 1)
+        replica = Client().get(
+            reverse("polls:results", args=[self.question.id]))
+        self.assertEqual(replica.context["choices"][0].votes, 0)
+
+
+# The votes come from one address as fast as they can.
+@override_settings(POLLS_VOTE_USER_RATE=0, POLLS_VOTE_IP_RATE=0)
+class ConcurrentVoteTests(TransactionTestCase):
+    """Stress test of the vote view on a file-based SQLite database.
+
+    Run it with DB_PROFILE=production to check the production profile.
+    """
+
+    def setUp(self):
+        cache.clear()
+        if connection.is_in_memory_db():
+            self.skipTest("needs a file-based SQLite database")
+        self.question = create_question(question_text="Stress", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question,
+                                  choice_text=f"Choice {n}")
+            for n in range(3)
+        ]
+        self.users = [User.objects.create_user(username=f"voter{n}")
+                      for n in range(16)]
+
+    def cast_votes(self, user):
+        """Vote several times as the user, from its own connection."""
+        try:
+            client = Client()
+            client.force_login(user)
+            url = reverse("polls:vote", args=[self.question.id])
+            return [
+                client.post(url, {"choice": choice.id}).status_code
+                for choice in self.choices
+            ]
+        finally:
+            connection.close()
+
+    def test_concurrent_votes(self):
+        """Concurrent votes all succeed and keep the tallies exact."""
+        with ThreadPoolExecutor(max_workers=len(self.users)) as pool:
+            statuses = list(pool.map(self.cast_votes, self.users))
+        self.assertEqual(
+            statuses, [[302] * len(self.choices)] * len(self.users))
+        self.assertEqual(Vote.objects.count(), len(self.users))
+        last = Choice.objects.get(pk=self.choices[-1].pk)
+        self.assertEqual(last.votes, len(self.users))
+
+
+class QuestionPageQueryTests(TestCase):
+    """Tests the query budget of the detail and results pages"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Budget", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question,
+                                  choice_text=f"Choice {n}")
+            for n in range(3)
+        ]
+        self.user = User.objects.create_user(username="voter")
+        Vote.objects.record(self.user, self.choices[1])
+
+    def test_detail_anonymous(self):
+        """An anonymous detail page checks the ETag, then loads
+        the question and its choices."""
+        with self.assertNumQueries(3):
+            self.client.get(reverse("polls:detail", args=[self.question.id]))
+
+    def test_detail_with_vote(self):
+        """The user's vote comes from the voted map, loaded once
+        for the ETag and the page."""
+        self.client.force_login(self.user)
+        # session, user, ETag, voted map, question, choices
+        with self.assertNumQueries(6):
+            response = self.client.get(
+                reverse("polls:detail", args=[self.question.id]))
+        self.assertEqual(response.context["marked"], self.choices[1])
+        self.assertEqual(
+            list(response.context["question"].choice_set.all()),
+            self.choices)
+        # session, user, ETag: the question and the voted map are cached
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse("polls:detail", args=[self.question.id]))
+        self.assertEqual(response.context["marked"], self.choices[1])
+
+    def test_results(self):
+        """The results page loads the question and its choices."""
+        self.client.force_login(self.user)
+        # session, user, ETag, voted map, question and choices
+        # to cache, tally version, choices with their tallies
+        with self.assertNumQueries(8):
+            self.client.get(reverse("polls:results", args=[self.question.id]))
+
+    def test_cached_results(self):
+        """The choices are not queried while the results table
+        is cached."""
+        url = reverse("polls:results", args=[self.question.id])
+        self.client.get(url)
+        # ETag and tally version
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+class VotedMapTests(TestCase):
+    """Tests the cached map of the polls each user voted in"""
+
+    def setUp(self):
+        cache.clear()
+        self.first = create_question(question_text="First", days=-2)
+        self.second = create_question(question_text="Second", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.first, choice_text="A")
+        self.other = Choice.objects.create(
+            question=self.second, choice_text="B")
+        self.user = User.objects.create_user(username="voter")
+        Vote.objects.record(self.user, self.choice)
+
+    def test_loaded_once(self):
+        """The map is loaded in one query, then read from the cache."""
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            voted = Vote.objects.voted_map(user)
+        self.assertEqual(voted, {self.first.id: self.choice.id})
+        # Another request of the same user
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(Vote.objects.voted_map(user),
+                             {self.first.id: self.choice.id})
+
+    # replica0 is not a database: a read routed to it fails.
+    @override_settings(DATABASE_ROUTERS=["polls.routers.ReplicaRouter"],
+                       POLLS_REPLICA_DATABASES=["replica0"])
+    def test_loaded_from_primary(self):
+        """The map is read from the primary, as it outlives the lag of
+        the replicas in the cache."""
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(Vote.objects.voted_map(user),
+                         {self.first.id: self.choice.id})
+
+    def test_vote_drops_map(self):
+        """A vote drops the cached map of its user."""
+        Vote.objects.voted_map(self.user)
+        Vote.objects.record(self.user, self.other)
+        self.assertEqual(Vote.objects.voted_map(self.user), {
+            self.first.id: self.choice.id, self.second.id: self.other.id})
+
+    def test_delete_drops_map(self):
+        """Deleting a vote drops the cached map of its user."""
+        Vote.objects.voted_map(self.user)
+        Vote.objects.filter(user=self.user).delete()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(Vote.objects.voted_map(user), {})
+
+    def test_index_badge(self):
+        """The index marks the polls the user voted in."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("polls:index"))
+        self.assertContains(response, "Voted</span>", count=1)
+        questions = response.context["latest_question_list"]
+        self.assertEqual(
+            {question.id: question.user_choice_id for question in questions},
+            {self.first.id: self.choice.id, self.second.id: None})
+
+    def test_index_without_badge(self):
+        """The badge can be turned off."""
+        self.client.force_login(self.user)
+        with self.settings(POLLS_VOTED_BADGE=False):
+            response = self.client.get(reverse("polls:index"))
+        self.assertNotContains(response, "Voted</span>")
+
+    def test_index_etag_follows_votes(self):
+        """A vote changes the ETag of the index."""
+        self.client.force_login(self.user)
+        url = reverse("polls:index")
+        etag = self.client.get(url)["ETag"]
+        Vote.objects.record(self.user, self.other)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Voted</span>", count=2)
+
+
+class MetadataCacheTests(TestCase):
+    """Tests the read-through cache of the questions and choices"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Cached", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question,
+                                  choice_text=f"Choice {n}")
+            for n in range(3)
+        ]
+
+    def test_read_through(self):
+        """A question is loaded once, with its choices in order."""
+        with self.assertNumQueries(2):
+            metadata.get_question(self.question.id)
+        with self.assertNumQueries(0):
+            question = metadata.get_question(self.question.id)
+            self.assertEqual(list(question.choice_set.all()), self.choices)
+            self.assertEqual(question.current_status(),
+                             Question.Status.OPEN)
+
+    def test_tallies_are_fresh(self):
+        """The tallies are not cached."""
+        metadata.get_question(self.question.id)
+        user = User.objects.create_user(username="voter")
+        Vote.objects.record(user, self.choices[0])
+        question = metadata.get_question(self.question.id)
+        choice = question.choice_set.all()[0]
+        self.assertEqual(choice.votes, 1)
+        self.assertEqual(
+            question.tally_version,
+            Question.objects.get(pk=self.question.id).tally_version)
+
+    def test_missing_question(self):
+        """A missing question is cached briefly, until it is created."""
+        self.assertIsNone(metadata.get_question(999))
+        with self.assertNumQueries(0):
+            self.assertIsNone(metadata.get_question(999))
+        Question.objects.create(pk=999, question_text="Late")
+        self.assertEqual(
+            metadata.get_question(999).question_text, "Late")
+
+    def test_missing_question_expires(self):
+        """A missing question is cached for MISSING_TIMEOUT seconds."""
+        with mock.patch.object(cache, "set") as cache_set:
+            metadata.get_question(999)
+        self.assertEqual(cache_set.call_args.args[2],
+                         metadata.MISSING_TIMEOUT)
+
+    def test_reads_primary(self):
+        """The entries are loaded from the primary, not a replica."""
+        queryset = metadata._questions(self.question.id)
+        with mock.patch("django.db.router.db_for_read",
+                        side_effect=AssertionError("read a replica")):
+            self.assertEqual(queryset.db, "default")
+            for lookup in queryset._prefetch_related_lookups:
+                self.assertEqual(lookup.queryset.db, "default")
+
+    def test_edits_drop_entry(self):
+        """Saving or deleting a question or a choice drops its entry."""
+        metadata.get_question(self.question.id)
+        self.question.question_text = "Edited"
+        self.question.save()
+        self.assertEqual(
+            metadata.get_question(self.question.id).question_text, "Edited")
+        self.choices[0].delete()
+        question = metadata.get_question(self.question.id)
+        self.assertEqual(list(question.choice_set.all()), self.choices[1:])
+
+    def test_admin_edit_drops_entry(self):
+        """An edit through the admin shows up on the detail page."""
+        admin = User.objects.create_superuser(username="admin")
+        self.client.force_login(admin)
+        url = reverse("polls:detail", args=[self.question.id])
+        self.client.get(url)
+        self.client.post(
+            reverse("admin:polls_choice_change", args=[self.choices[0].id]),
+            {"question": self.question.id, "choice_text": "Renamed",
+             "votes": 0})
+        self.assertContains(self.client.get(url), "Renamed")
+
+    def test_waits_for_loading_request(self):
+        """While another request loads an entry, the others wait for it
+        instead of querying."""
+        cache.add("polls:question:%d:lock" % self.question.id, 1)
+        cached = Question.objects.get(pk=self.question.id)
+
+        def loaded(seconds):
+            cache.set(f"polls:question:{self.question.id}",
+                      (float("inf"), cached))
+
+        with mock.patch("polls.metadata.time.sleep", loaded):
+            with self.assertNumQueries(0):
+                question = metadata.get_question(self.question.id)
+        self.assertEqual(question, cached)
+
+    def test_stops_waiting(self):
+        """A request loads the entry itself when the request holding
+        the lock takes too long."""
+        cache.add("polls:question:%d:lock" % self.question.id, 1)
+        with mock.patch.object(metadata, "LOCK_WAIT", 0):
+            question = metadata.get_question(self.question.id)
+        self.assertEqual(question, self.question)
+
+    def test_early_refresh(self):
+        """An entry close to its timeout is refreshed by one request
+        while the others keep reading it."""
+        key = f"polls:question:{self.question.id}"
+        old = Question(pk=self.question.id, question_text="Old",
+                       pub_date=self.question.pub_date)
+        cache.set(key, (0, old))
+        cache.add(f"{key}:lock", 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                metadata.get_question(self.question.id).question_text, "Old")
+        cache.delete(f"{key}:lock")
+        self.assertEqual(
+            metadata.get_question(self.question.id).question_text, "Cached")
+
+    def test_current_status(self):
+        """current_status() agrees with the status computed in SQL."""
+        now = timezone.now()
+        day = datetime.timedelta(days=1)
+        for pub_date, end_date in [(now - day, None), (now + day, None),
+                                   (now - 3 * day, now - day),
+                                   (now - day, now), (now, now + day)]:
+            Question.objects.create(question_text="Status",
+                                    pub_date=pub_date, end_date=end_date)
+        for question in Question.objects.with_status():
+            with self.subTest(pub_date=question.pub_date,
+                              end_date=question.end_date):
+                self.assertEqual(question.current_status(), question.status)
+
+    async def test_async_read_through(self):
+        """The async reads share the entries."""
+        question = await metadata.aget_question(self.question.id)
+        self.assertEqual(question, self.question)
+        self.assertIsNotNone(
+            await cache.aget(f"polls:question:{self.question.id}"))
+        self.assertIsNone(await metadata.aget_question(999))
+
+
+@override_settings(POLLS_VOTE_USER_RATE=1, POLLS_VOTE_USER_BURST=2,
+                   POLLS_VOTE_IP_RATE=1, POLLS_VOTE_IP_BURST=3)
+class AdmissionControlTests(TestCase):
+    """Tests the rate limits and the in-flight limit of the votes"""
+
+    def setUp(self):
+        cache.clear()
+        throttle.COUNTERS.clear()
+        self.question = create_question(question_text="Viral", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text="Yes")
+        self.url = reverse("polls:vote", args=[self.question.id])
+
+    def vote(self, username, ip="10.0.0.1"):
+        """Post a vote of the user from the address."""
+        user, _ = User.objects.get_or_create(username=username)
+        self.client.force_login(user)
+        return self.client.post(self.url, {"choice": self.choice.id},
+                                REMOTE_ADDR=ip)
+
+    def test_user_bucket(self):
+        """A user voting faster than the rate gets 429 after the burst."""
+        statuses = [self.vote("voter", ip=f"10.0.0.{n}").status_code
+                    for n in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(throttle.COUNTERS,
+                         {"accepted": 2, "throttled": 1})
+
+    def test_ip_bucket(self):
+        """Users sharing an address share its bucket."""
+        statuses = [self.vote(f"voter{n}").status_code for n in range(4)]
+        self.assertEqual(statuses, [302, 302, 302, 429])
+
+    def test_forwarded_for_ignored(self):
+        """Without trusted proxies, X-Forwarded-For cannot give each
+        vote a bucket of its own."""
+        statuses = []
+        for n in range(4):
+            self.client.force_login(
+                User.objects.create_user(username=f"voter{n}"))
+            statuses.append(self.client.post(
+                self.url, {"choice": self.choice.id}, REMOTE_ADDR="10.0.0.1",
+                HTTP_X_FORWARDED_FOR=f"192.0.2.{n}").status_code)
+        self.assertEqual(statuses, [302, 302, 302, 429])
+
+    @override_settings(POLLS_TRUSTED_PROXIES=1)
+    def test_trusted_proxy(self):
+        """Behind a trusted proxy, the address it added is the one of
+        the bucket, normalized, whatever the client put before it."""
+        request = RequestFactory().get(
+            "/", REMOTE_ADDR="10.0.0.9",
+            HTTP_X_FORWARDED_FOR="spoofed, 2001:DB8:0:0::1")
+        self.assertEqual(throttle.client_address(request), "2001:db8::1")
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9")
+        self.assertEqual(throttle.client_address(request), "10.0.0.9")
+
+    def test_address_key_valid(self):
+        """Any address gives a short cache key without spaces."""
+        key = throttle._address_key("not an address " + "x" * 300)
+        self.assertLess(len(key), 100)
+        self.assertNotIn(" ", key)
+        self.assertEqual(key, throttle._address_key(
+            "not an address " + "x" * 300))
+
+    def test_refused_before_database(self):
+        """A throttled vote only reads the session and says when to
+        come back."""
+        for _ in range(2):
+            self.vote("voter")
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {"choice": self.choice.id},
+                                        REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_bucket_refills(self):
+        """Tokens come back at the rate."""
+        for _ in range(2):
+            self.vote("voter")
+        later = time.time() + 1
+        with mock.patch("polls.throttle.time.time", return_value=later):
+            self.assertEqual(self.vote("voter").status_code, 302)
+
+    def slow_spend(self):
+        """Return a patch making each bucket update slow, so concurrent
+        takes overlap."""
+        spend = throttle._spend
+
+        def slow(*args):
+            time.sleep(0.01)
+            return spend(*args)
+        return mock.patch("polls.throttle._spend", slow)
+
+    def test_concurrent_takes(self):
+        """Concurrent votes cannot spend the same token."""
+        with self.slow_spend(), ThreadPoolExecutor(4) as pool:
+            waits = list(pool.map(
+                lambda _: throttle.take_token("polls:bucket:test", 1, 1),
+                range(4)))
+        self.assertEqual(waits.count(0), 1)
+
+    async def test_concurrent_atakes(self):
+        """So do concurrent async votes."""
+        with self.slow_spend():
+            waits = await asyncio.gather(*[
+                throttle.atake_token("polls:bucket:test", 1, 1)
+                for _ in range(4)])
+        self.assertEqual(waits.count(0), 1)
+
+    @override_settings(POLLS_VOTE_MAX_IN_FLIGHT=1)
+    def test_in_flight_limit(self):
+        """Votes over the in-flight limit are shed with 503."""
+        throttle._enter()
+        try:
+            response = self.vote("voter")
+        finally:
+            throttle._leave()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(throttle.COUNTERS, {"shed": 1})
+        self.assertEqual(self.vote("voter").status_code, 302)
+        self.assertEqual(throttle.in_flight(), 0)
+
+    def test_counters_endpoint(self):
+        """Staff members can read the counters."""
+        self.vote("voter")
+        url = reverse("polls:admission")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(
+            User.objects.create_user(username="staff", is_staff=True))
+        self.assertEqual(self.client.get(url).json(),
+                         {"accepted": 1, "in_flight": 0})
+
+
+class ServerTimingTests(TestCase):
+    """Tests the request timings and the metrics page"""
+
+    def setUp(self):
+        cache.clear()
+        metrics._process = None
+        self.question = create_question(question_text="Timed", days=-1)
+        Choice.objects.create(question=self.question, choice_text="A")
+
+    def timings(self, response) -> dict:
+        """Return the Server-Timing entries by name."""
+        entries = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            entries[name] = dict(param.split("=", 1) for param in params)
+        return entries
+
+    def test_header(self):
+        """The header has the database, template and total times."""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(
+                reverse("polls:detail", args=[self.question.id]))
+        timings = self.timings(response)
+        self.assertEqual(timings["db"]["desc"],
+                         f'"{len(captured)} queries"')
+        self.assertGreater(float(timings["tpl"]["dur"]), 0)
+        self.assertGreaterEqual(float(timings["total"]["dur"]),
+                                float(timings["tpl"]["dur"]))
+
+    def test_wrappers_of_a_connection_opened_in_execute_wrapper(self):
+        """A connection opening inside connection.execute_wrapper() gets
+        the polls wrappers without unbalancing the caller's."""
+        def mine(execute, *args):
+            return execute(*args)
+        saved = connection.execute_wrappers[:]
+        self.addCleanup(setattr, connection, "execute_wrappers", saved)
+        connection.execute_wrappers = []
+        with connection.execute_wrapper(mine):
+            instrument_connection(None, connection)
+            self.assertEqual(connection.execute_wrappers,
+                             [log_slow_query, time_query, mine])
+        self.assertEqual(connection.execute_wrappers,
+                         [log_slow_query, time_query])
+
+    def test_header_off(self):
+        """The header can be turned off."""
+        with self.settings(POLLS_SERVER_TIMING=False):
+            response = self.client.get(reverse("polls:index"))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_histograms_by_url_name(self):
+        """Each request is counted under its URL name."""
+        for _ in range(2):
+            self.client.get(reverse("polls:index"))
+        histograms = metrics.collect()["histograms"]
+        counts, total = histograms["polls_view_duration_seconds",
+                                   "polls:index"]
+        self.assertEqual(sum(counts), 2)
+        self.assertGreater(total, 0)
+        self.assertNotIn(("polls_view_duration_seconds", "polls:detail"),
+                         histograms)
+
+    def test_metrics_page(self):
+        """Staff members get the metrics in the Prometheus text format."""
+        self.client.get(reverse("polls:index"))
+        self.assertEqual(self.client.get("/metrics").status_code, 302)
+        self.client.force_login(
+            User.objects.create_user(username="staff", is_staff=True))
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"],
+                         "text/plain; version=0.0.4; charset=utf-8")
+        self.assertContains(response, "# TYPE polls_db_queries histogram")
+        self.assertContains(
+            response, 'polls_view_duration_seconds_bucket'
+                      '{view="polls:index",le="+Inf"} 1')
+        self.assertContains(
+            response, 'polls_view_duration_seconds_count'
+                      '{view="polls:index"} 1')
+
+    def test_processes_add_up(self):
+        """The metrics written by other processes are added up."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        buckets = len(metrics.SECONDS) + 1
+        other = {
+            "histograms": [["polls_view_duration_seconds", "polls:index",
+                            [1] + [0] * (buckets - 1), 0.5]],
+            "counters": {metrics.ADMISSION: {"shed": 3}},
+        }
+        with open(os.path.join(directory, "1-1.json"), "w") as snapshot:
+            json.dump(other, snapshot)
+        with self.settings(POLLS_METRICS_DIR=directory):
+            self.client.get(reverse("polls:index"))
+            text = metrics.text_format(metrics.collect())
+            # The first request writes the metrics of this process.
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('polls_view_duration_seconds_count'
+                      '{view="polls:index"} 2', text)
+        self.assertIn('polls_vote_admission_total{outcome="shed"} 3', text)
+
+    @skipIf(os.name == "nt", "the files are kept on Windows")
+    def test_exited_processes_merged(self):
+        """The files of the processes that exited are merged into one,
+        keeping their totals."""
+        throttle.COUNTERS.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited = subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"],
+            capture_output=True, text=True).stdout.strip()
+        buckets = len(metrics.SECONDS) + 1
+        for n in range(3):
+            with open(os.path.join(directory, f"{exited}-{n}.json"),
+                      "w") as snapshot:
+                json.dump({"counters": {metrics.ADMISSION: {"shed": 1}},
+                           "histograms": [[
+                               "polls_db_queries", "polls:index",
+                               [1] + [0] * (buckets - 1), 0]]}, snapshot)
+        with self.settings(POLLS_METRICS_DIR=directory):
+            for _ in range(2):
+                collected = metrics.collect()
+                self.assertEqual(os.listdir(directory), [metrics.MERGED])
+                self.assertEqual(
+                    collected["counters"][metrics.ADMISSION], {"shed": 3})
+                self.assertEqual(sum(collected["histograms"][
+                    "polls_db_queries", "polls:index"][0]), 3)
+
+
+@override_settings(POLLS_SLOW_QUERY_MS=0.000001)
+class SlowQueryLogTests(TestCase):
+    """Tests the log of the slow queries"""
+
+    def setUp(self):
+        cache.clear()
+        create_question(question_text="Slow", days=-1)
+        slowlog._window.update(start=float("-inf"), logged=0, suppressed=0)
+
+    def test_request_queries(self):
+        """The queries of a request name its view and the code
+        running them."""
+        with self.assertLogs("polls.slow_queries", "WARNING") as logs:
+            self.client.get(reverse("polls:index"))
+        entry = next(line for line in logs.output
+                     if "polls_question" in line)
+        self.assertIn("ms in GET polls:index at polls/", entry)
+        self.assertIn("Query plan:", entry)
+
+    def test_full_scan(self):
+        """The query plan names the tables read in full."""
+        with self.assertLogs("polls.slow_queries", "WARNING") as logs:
+            list(Vote.objects.filter(choice__choice_text="A"))
+        entry = logs.output[0]
+        self.assertIn("ms in no request at polls/tests.py:", entry)
+        self.assertIn("in test_full_scan", entry)
+        self.assertRegex(entry, r"Full scans: .*polls_(vote|choice)")
+
+    def test_rate_limit(self):
+        """Entries over the limit of the minute are counted in the
+        next one written."""
+        with self.settings(POLLS_SLOW_QUERY_LOG_LIMIT=2):
+            with self.assertLogs("polls.slow_queries", "WARNING") as logs:
+                for _ in range(4):
+                    Question.objects.count()
+                slowlog._window["start"] = float("-inf")
+                Question.objects.count()
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn("(2 slow queries not logged before this one)",
+                      logs.output[2])
+
+    @override_settings(ROOT_URLCONF=__name__,
+                       POLLS_SLOW_QUERY_LOG_LIMIT=1000)
+    async def test_concurrent_requests(self):
+        """The queries of concurrent async requests name their own
+        view."""
+        question = await Question.objects.aget()
+        with self.assertLogs("polls.slow_queries", "WARNING") as logs:
+            await asyncio.gather(*[
+                self.async_client.get(reverse(name, args=args))
+                for name, args in [("polls:index", [])] * 5
+                + [("polls:results", [question.id])] * 5])
+        index = [line for line in logs.output
+                 if 'MAX("polls_question"."pub_date")' in line]
+        self.assertTrue(index)
+        for line in index:
+            self.assertIn("ms in GET polls:index at", line)
+
+    def test_off(self):
+        """Nothing is logged without a threshold."""
+        with self.settings(POLLS_SLOW_QUERY_MS=0):
+            with self.assertNoLogs("polls.slow_queries"):
+                self.client.get(reverse("polls:index"))
+
+
+class QueryBudgetTests(TestCase):
+    """Tests that the query count of every page stays the same
+    with 3 or 300 choices and 5 or 500 polls"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="budget")
+
+    def create_poll(self, choices):
+        """Create a published poll with the given number of choices,
+        each with a vote."""
+        question = create_question(question_text="Budget", days=-1)
+        created = Choice.objects.bulk_create([
+            Choice(question=question, choice_text=f"Choice {n}")
+            for n in range(choices)
+        ])
+        voters = User.objects.bulk_create([
+            User(username=f"voter{question.id}-{n}") for n in range(choices)
+        ])
+        for voter, choice in zip(voters, created):
+            Vote.objects.record(voter, choice)
+        return question
+
+    def create_polls(self, count):
+        """Create polls with three choices each."""
+        for _ in range(count):
+            self.create_poll(choices=3)
+
+    def capture(self, method, url, data=None):
+        """Return the queries of one request."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            getattr(self.client, method)(url, data)
+        return [query["sql"] for query in captured]
+
+    def assertSameQueries(self, small, large):
+        """Fail with both query lists when their lengths differ."""
+        if len(small) != len(large):
+            self.fail(
+                f"{len(small)} queries on the small dataset, {len(large)} "
+                "on the large one.\n\nSmall:\n" + "\n".join(small)
+                + "\n\nLarge:\n" + "\n".join(large))
+
+    def assertConstantForChoices(self, method, view, data=None):
+        """Compare the view on a poll with 3 choices and one with 300."""
+        small = self.create_poll(choices=3)
+        large = self.create_poll(choices=300)
+        self.assertSameQueries(
+            self.capture(method, reverse(view, args=[small.id]), data),
+            self.capture(method, reverse(view, args=[large.id]), data))
+
+    def test_index(self):
+        """The index costs the same with 5 polls or 500."""
+        url = reverse("polls:index")
+        self.create_polls(5)
+        small = self.capture("get", url)
+        self.create_polls(495)
+        self.assertSameQueries(small, self.capture("get", url))
+
+    def test_index_filtered_logged_in(self):
+        """So does the filtered index of a logged in user."""
+        self.client.force_login(self.user)
+        url = reverse("polls:index")
+        self.create_polls(5)
+        small = self.capture("get", url, {"status": "open"})
+        self.create_polls(495)
+        self.assertSameQueries(
+            small, self.capture("get", url, {"status": "open"}))
+
+    def test_detail(self):
+        """The detail page costs the same with 3 choices or 300."""
+        self.assertConstantForChoices("get", "polls:detail")
+
+    def test_detail_logged_in(self):
+        """So does the detail page of a logged in user."""
+        self.client.force_login(self.user)
+        self.assertConstantForChoices("get", "polls:detail")
+
+    def test_results(self):
+        """The results page costs the same with 3 choices or 300."""
+        self.assertConstantForChoices("get", "polls:results")
+
+    def test_results_logged_in(self):
+        """So does the results page of a logged in user."""
+        self.client.force_login(self.user)
+        self.assertConstantForChoices("get", "polls:results")
+
+    def test_vote(self):
+        """A vote costs the same with 3 choices or 300."""
+        self.client.force_login(self.user)
+        small = self.create_poll(choices=3)
+        large = self.create_poll(choices=300)
+        self.assertSameQueries(
+            self.capture("post", reverse("polls:vote", args=[small.id]),
+                         {"choice": small.choice_set.last().id}),
+            self.capture("post", reverse("polls:vote", args=[large.id]),
+                         {"choice": large.choice_set.last().id}))
+
+
+class LoadPollsDataTests(TestCase):
+    """Tests the streaming fixture loader"""
+
+    def load(self, *fixtures, **options):
+        call_command("load_polls_data", *fixtures, stdout=io.StringIO(),
+                     **options)
+
+    def test_parse_across_chunks(self):
+        """Items split between chunks are parsed whole."""
+        with open("data/polls-v4.json", encoding="utf-8") as fixture:
+            expected = json.load(fixture)
+            fixture.seek(0)
+            self.assertEqual(
+                list(iter_json_array(fixture, chunk_size=7)), expected)
+
+    def test_truncated_fixture(self):
+        """A fixture cut in the middle of its array is rejected."""
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"model": "polls.vote"}, {')))
+
+    def test_load(self):
+        """The data fixtures load with their vote tallies."""
+        self.load("data/users.json", "data/polls-v4.json",
+                  "data/votes-v4.json", batch_size=10)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Question.objects.count(), 7)
+        self.assertEqual(Choice.objects.count(), 50)
+        self.assertEqual(Choice.objects.get(pk=4).votes, 1)
+        # Loading again overwrites the same rows.
+        self.load("data/polls-v4.json")
+        self.assertEqual(Choice.objects.count(), 50)
+
+    def test_dangling_foreign_key(self):
+        """Votes of missing users stop the load unless skipped."""
+        self.load("data/polls-v4.json")
+        with self.assertRaisesMessage(CommandError, "missing rows"):
+            self.load("data/votes-v4.json")
+        self.assertFalse(Vote.objects.exists())
+        self.load("data/votes-v4.json", skip_invalid=True)
+        self.assertFalse(Vote.objects.exists())
+
+    def write_votes(self, *votes):
+        """Return the path of a fixture of votes given as (pk, fields)."""
+        fixture = tempfile.NamedTemporaryFile(
+            "w", suffix=".json", delete=False)
+        with fixture:
+            json.dump([{"model": "polls.vote", "pk": pk, "fields": fields}
+                       for pk, fields in votes], fixture)
+        self.addCleanup(os.remove, fixture.name)
+        return fixture.name
+
+    def test_votes_without_question(self):
+        """Votes of older dumps get the question of their choice."""
+        self.load("data/users.json", "data/polls-v4.json")
+        self.load(self.write_votes((1, {"choice": 4, "user": 2})))
+        self.assertEqual(Vote.objects.get().question_id,
+                         Choice.objects.get(pk=4).question_id)
+
+    def test_integrity_error(self):
+        """A fixture the database rejects stops with a command error."""
+        self.load("data/users.json", "data/polls-v4.json")
+        fixture = self.write_votes((1, {"choice": 4, "user": 2}),
+                                   (2, {"choice": 4, "user": 2}))
+        with self.assertRaisesMessage(CommandError, "Failed to load"):
+            self.load(fixture)
+
+    def test_progress(self):
+        """The progress is reported by default, not with -v 0."""
+        out = io.StringIO()
+        call_command("load_polls_data", "data/users.json", stdout=out)
+        self.assertIn("data/users.json: 100%", out.getvalue())
+        out = io.StringIO()
+        call_command("load_polls_data", "data/users.json", stdout=out,
+                     verbosity=0)
+        self.assertNotIn("%", out.getvalue())
+
+    def test_invalid_batch_size(self):
+        """A batch size below 1 stops the load before it starts."""
+        for size in ("0", "-1"):
+            with self.assertRaisesMessage(CommandError, "--batch-size"):
+                call_command("load_polls_data", "data/users.json",
+                             "--batch-size", size, stdout=io.StringIO())
+        self.assertFalse(User.objects.exists())
+
+
+class ExportTests(TestCase):
+    """Tests the streaming exports of the votes and results"""
+
+    def setUp(self):
+        self.old = create_question(question_text="Old", days=-30)
+        self.new = create_question(question_text="New", days=-1)
+        self.old_choice = Choice.objects.create(
+            question=self.old, choice_text="Yes")
+        self.new_choice = Choice.objects.create(
+            question=self.new, choice_text="No")
+        self.voter = User.objects.create_user(username="voter")
+        Vote.objects.record(self.voter, self.old_choice)
+        Vote.objects.record(self.voter, self.new_choice)
+        self.old_vote = Vote.objects.get(question=self.old)
+        self.staff = User.objects.create_user(username="staff",
+                                              is_staff=True)
+
+    def test_staff_only(self):
+        """Users who are not staff are sent to the admin login."""
+        self.client.force_login(self.voter)
+        response = self.client.get(reverse("polls:export", args=["votes"]))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response.url)
+
+    def test_votes_csv(self):
+        """The votes stream out as CSV."""
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("polls:export", args=["votes"]))
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "vote_id,question_id,choice_id,user_id")
+        self.assertEqual(len(lines), 3)
+
+    def test_results_ndjson_filtered(self):
+        """Results can be limited to questions published in a range."""
+        self.client.force_login(self.staff)
+        since = (timezone.now() - datetime.timedelta(days=2)).date()
+        response = self.client.get(
+            reverse("polls:export", args=["results"]),
+            {"format": "ndjson", "since": since.isoformat()})
+        rows = [json.loads(line) for line in
+                b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [{
+            "question_id": self.new.id, "question_text": "New",
+            "choice_id": self.new_choice.id, "choice_text": "No",
+            "votes": 1}])
+
+    def test_bad_filter(self):
+        """A malformed filter is rejected."""
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            reverse("polls:export", args=["votes"]), {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_stream(self):
+        """Under ASGI the export streams from the async iterator."""
+        await self.async_client.aforce_login(self.staff)
+        with mock.patch("polls.export.CHUNK_SIZE", 1):
+            response = await self.async_client.get(
+                reverse("polls:export", args=["votes"]))
+            chunks = [chunk async for chunk in response.streaming_content]
+        # The header, then one chunk per vote
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(
+            chunks[1].decode(),
+            f"{self.old_vote.pk},{self.old.id},{self.old_choice.id},"
+            f"{self.voter.id}\r\n")
+
+    def test_command(self):
+        """The command writes the same export."""
+        out = io.StringIO()
+        call_command("export_polls", "votes", "--question", str(self.new.id),
+                     stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class LoggingTests(TestCase):
+    """Tests the queued logging pipeline"""
+
+    def setUp(self):
+        cache.clear()
+        self.target = BufferingHandler(100)
+        self.target.name = "test_target"
+        self.addCleanup(self.target.close)
+
+    def record(self, level, msg, *args):
+        return logging.LogRecord("polls.test", level, __file__, 1, msg,
+                                 args, None)
+
+    def test_listener_writes_records(self):
+        """Queued records reach the target handler from the thread."""
+        handler = QueueListenerHandler(["test_target"])
+        handler.handle(self.record(logging.INFO, "vote %s", 1))
+        handler.close()
+        self.assertEqual(
+            [record.getMessage() for record in self.target.buffer],
+            ["vote 1"])
+
+    def test_full_queue_drops(self):
+        """A full queue drops records instead of blocking."""
+        handler = QueueListenerHandler(["test_target"], maxsize=1)
+        handler.enqueue(self.record(logging.INFO, "first"))
+        handler.enqueue(self.record(logging.INFO, "second"))
+        self.assertEqual(handler.dropped, 1)
+
+    def test_missing_handler(self):
+        """Naming a handler that is not configured fails when the
+        listener starts."""
+        handler = QueueListenerHandler(["no_such_handler"])
+        with self.assertRaises(ValueError):
+            handler._start()
+
+    def test_queue_configured_before_target(self):
+        """The queue may be configured before the handlers it wraps,
+        whatever their names."""
+        stream = io.StringIO()
+        self.addCleanup(logging.config.dictConfig, settings.LOGGING)
+        logging.config.dictConfig({
+            "version": 1,
+            "disable_existing_loggers": False,
+            "handlers": {
+                "async": {"()": "polls.log.QueueListenerHandler",
+                          "handlers": ["console"]},
+                "console": {"class": "logging.StreamHandler",
+                            "stream": stream},
+            },
+            "loggers": {"polls.test": {"handlers": ["async"]}},
+        })
+        handler = logging.getLogger("polls.test").handlers[0]
+        logging.getLogger("polls.test").warning("queued")
+        handler.close()
+        self.assertEqual(stream.getvalue(), "queued\n")
+
+    def test_sampling(self):
+        """Sampling drops info records but keeps warnings."""
+        sample = SampleFilter(rate=0)
+        self.assertFalse(sample.filter(self.record(logging.INFO, "vote")))
+        self.assertTrue(sample.filter(self.record(logging.WARNING, "oops")))
+
+    def test_vote_logs_are_lazy(self):
+        """The vote view passes its log arguments unformatted."""
+        question = create_question(question_text="Logged", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="A")
+        self.client.force_login(User.objects.create_user(username="voter"))
+        with mock.patch.object(sync_views.vote_logger, "info") as info:
+            self.client.post(reverse("polls:vote", args=[question.id]),
+                             {"choice": choice.id})
+        info.assert_any_call("Question %s vote for choice %s",
+                             question.id, str(choice.id))
+
+
+class SessionStrategyTests(TestCase):
+    """Tests the queries saved by the session and message storages"""
+
+    def setUp(self):
+        self.question = create_question(question_text="Session", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text="Yes")
+        self.user = User.objects.create_user(username="voter")
+
+    def count_results(self, engine, storage):
+        """Return the queries of the results page seen by an anonymous
+        visitor holding a session."""
+        cache.clear()
+        with self.settings(SESSION_ENGINE=engine, MESSAGE_STORAGE=storage):
+            # The session middleware loads the engine once per handler.
+            client = Client()
+            session = client.session
+            session["seen"] = True
+            session.save()
+            with CaptureQueriesContext(connection) as captured:
+                client.get(reverse("polls:results", args=[self.question.id]))
+        return len(captured)
+
+    def count_vote(self, engine):
+        """Return the queries of a vote by a logged in user."""
+        cache.clear()
+        with self.settings(SESSION_ENGINE=engine):
+            client = Client()
+            client.force_login(self.user)
+            with CaptureQueriesContext(connection) as captured:
+                client.post(reverse("polls:vote", args=[self.question.id]),
+                            {"choice": self.choice.id})
+        return len(captured)
+
+    def test_anonymous_results(self):
+        """Cookie sessions and messages spare the session query of the
+        results page."""
+        db = self.count_results(
+            "django.contrib.sessions.backends.db",
+            "django.contrib.messages.storage.session.SessionStorage")
+        cookies = self.count_results(
+            "django.contrib.sessions.backends.signed_cookies",
+            "django.contrib.messages.storage.cookie.CookieStorage")
+        self.assertEqual(db - cookies, 1)
+
+    def test_logged_in_vote(self):
+        """Signed cookie and cached sessions spare the session query of
+        a vote."""
+        db = self.count_vote("django.contrib.sessions.backends.db")
+        for engine in ("signed_cookies", "cached_db"):
+            with self.subTest(engine=engine):
+                self.assertEqual(
+                    db - self.count_vote(
+                        f"django.contrib.sessions.backends.{engine}"), 1)
+
+
+@override_settings(
+    PASSWORD_HASHERS=["polls.hashers.TunedPBKDF2PasswordHasher",
+                      "polls.hashers.TunedScryptPasswordHasher"],
+    PASSWORD_PBKDF2_ITERATIONS=1000,
+    PASSWORD_SCRYPT_WORK_FACTOR=1024,
+)
+class PasswordHasherTests(TestCase):
+    """Tests the password hashers tuned from the settings"""
+
+    def create_user(self, iterations):
+        """Create a user whose password was hashed with PBKDF2 at the
+        given number of iterations."""
+        hasher = PBKDF2PasswordHasher()
+        return User.objects.create(
+            username="student",
+            password=hasher.encode("FatChance!", hasher.salt(), iterations))
+
+    def test_rehash_on_login(self):
+        """A password hashed at another cost is rehashed at login."""
+        user = self.create_user(iterations=2000)
+        self.assertTrue(self.client.login(username="student",
+                                          password="FatChance!"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+
+    def test_switch_to_scrypt(self):
+        """Passwords move to scrypt at login once it comes first."""
+        user = self.create_user(iterations=1000)
+        with self.settings(PASSWORD_HASHERS=[
+                "polls.hashers.TunedScryptPasswordHasher",
+                "polls.hashers.TunedPBKDF2PasswordHasher"]):
+            self.assertTrue(self.client.login(username="student",
+                                              password="FatChance!"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("scrypt$1024$"))
+
+    def test_scrypt_maxmem_capped(self):
+        """The memory limit of a large work factor stays within what
+        hashlib takes, and above what scrypt needs."""
+        n, r, p = 2 ** 20, 8, 1
+        maxmem = hashers.scrypt_maxmem(n, r, p)
+        self.assertEqual(maxmem, hashers.SCRYPT_MAXMEM_CAP)
+        self.assertGreater(maxmem, 128 * r * (n + p + 2))
+        # Hashing at n = 2 ** 20 takes a GiB: check the limit on a
+        # small one.
+        hashlib.scrypt(b"FatChance!", salt=b"salt", n=2, r=1, p=1,
+                       maxmem=maxmem)
+
+    def test_scrypt_checks_costlier_hash(self):
+        """A hash made before the work factor was lowered still checks."""
+        hasher = ScryptPasswordHasher()
+        encoded = hasher.encode("FatChance!", hasher.salt(), n=2 ** 14, r=1)
+        User.objects.create(username="student", password=encoded)
+        with self.settings(PASSWORD_SCRYPT_BLOCK_SIZE=1, PASSWORD_HASHERS=[
+                "polls.hashers.TunedScryptPasswordHasher"]):
+            self.assertTrue(self.client.login(username="student",
+                                              password="FatChance!"))
+
+    def test_bench_login(self):
+        """The benchmark reports the configured and candidate hashers."""
+        out = io.StringIO()
+        call_command("bench_login", "--pbkdf2-iterations", "1000",
+                     "--scrypt-work-factors", "1024", "--repeat", "1",
+                     stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(len(report["hashers"]), 3)
+        self.assertGreater(
+            report["hashers"][0]["logins_per_second_per_core"], 0)
+
+
+class BenchPollsTests(django.test.SimpleTestCase):
+    """Tests the benchmark of the polls pages"""
+
+    def test_report(self):
+        """The benchmark reports every page as JSON."""
+        # In a process of its own, as it sets up its own test database.
+        output = subprocess.run(
+            [sys.executable, "manage.py", "bench_polls", "--questions", "2",
+             "--choices", "2", "--users", "2", "--votes", "2",
+             "--requests", "2"],
+            capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR).stdout
+        report = json.loads(output)
+        self.assertEqual(set(report["pages"]),
+                         {"index", "detail", "results", "vote"})
+        self.assertEqual(
+            set(report["pages"]["vote"]),
+            {"p50_ms", "p95_ms", "p99_ms", "queries_mean", "queries_max",
+             "peak_memory_kib", "statuses"})
+
+    def test_invalid_arguments(self):
+        """Too few requests or no question stop the benchmark."""
+        with self.assertRaisesMessage(CommandError, "--requests"):
+            call_command("bench_polls", "--requests", "1")
+        with self.assertRaisesMessage(CommandError, "--questions"):
+            call_command("bench_polls", "--questions", "0")
+
+
+class StaticAssetsTests(TestCase):
+    """Tests the static files build and the precompressed serving"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as static_file:
+            static_file.write(data)
+        return path
+
+    def test_variants(self):
+        """Text files get a gzip variant, images do not."""
+        css = self.write("style.css", b"body { color: red; }\n" * 50)
+        png = self.write("image.png", bytes(300))
+        self.assertEqual(assets.write_variants(css), [css + ".gz"])
+        self.assertEqual(assets.write_variants(png), [])
+        with gzip.open(css + ".gz") as variant:
+            self.assertEqual(variant.read(), b"body { color: red; }\n" * 50)
+
+    def serve(self, path, **headers):
+        with self.settings(STATIC_ROOT=self.root):
+            middleware = PrecompressedStaticMiddleware(
+                lambda request: HttpResponse("app"))
+        middleware.hashed = {"style.0123456789ab.css"}
+        return middleware(RequestFactory().get(path, headers=headers))
+
+    def test_precompressed(self):
+        """A hashed file is served precompressed and immutable."""
+        css = self.write("style.0123456789ab.css", b"p { margin: 0; }\n" * 50)
+        assets.write_variants(css)
+        response = self.serve("/static/style.0123456789ab.css",
+                              accept_encoding="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Cache-Control"],
+                         "public, max-age=31536000, immutable")
+        self.assertEqual(gzip.decompress(b"".join(response)),
+                         b"p { margin: 0; }\n" * 50)
+        response = self.serve("/static/style.0123456789ab.css",
+                              accept_encoding="gzip;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_unhashed_and_missing(self):
+        """Unhashed files are revalidated, missing ones reach the app."""
+        self.write("robots.txt", b"User-agent: *\n")
+        response = self.serve("/static/robots.txt")
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+        self.assertEqual(self.serve("/static/missing.css").content, b"app")
+        self.assertEqual(self.serve("/static/../settings.py").content,
+                         b"app")
+
+    def test_bootstrap_loaded_once(self):
+        """Pages load Bootstrap once, from the static files, which ship
+        with the license of Bootstrap."""
+        response = self.client.get(reverse("polls:index"))
+        self.assertContains(response, "bootstrap.min.css", count=1)
+        self.assertContains(response, "bootstrap.bundle.min.js", count=1)
+        self.assertNotContains(response, "cdn.jsdelivr.net")
+        for local, _, _ in polls_assets.BOOTSTRAP_FILES.values():
+            self.assertContains(response, f'"/static/{local}"')
+            self.assertIsNotNone(finders.find(local))
+        self.assertIsNotNone(
+            finders.find("polls/vendor/bootstrap/LICENSE"))
+
+
+# The polls URLs routed to the async views, for AsyncViewTests.
+urlpatterns = [
+    path("polls/", include(([
+        path("", async_views.AsyncIndexView.as_view(), name="index"),
+        path("<int:pk>/", async_views.AsyncDetailView.as_view(),
+             name="detail"),
+        path("<int:pk>/result/", async_views.AsyncResultsView.as_view(),
+             name="results"),
+        path("<int:pk>/result/stream/", sync_views.results_stream,
+             name="results_stream"),
+        path("<int:question_id>/vote/", async_views.vote, name="vote"),
+    ], "polls"))),
+    path("accounts/", include("django.contrib.auth.urls")),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    """Tests the async views through the ASGI handler"""
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Async", days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text="A")
+        self.user = User.objects.create_user(username="voter")
+
+    async def test_index(self):
+        """The async index lists the published questions."""
+        response = await self.async_client.get(reverse("polls:index"))
+        self.assertEqual(
+            response.context["latest_question_list"], [self.question])
+
+    async def test_detail_closed_question(self):
+        """The async detail page redirects away from a closed poll."""
+        closed = await Question.objects.acreate(
+            question_text="Closed",
+            pub_date=timezone.now() - datetime.timedelta(days=10),
+            end_date=timezone.now() - datetime.timedelta(days=5))
+        response = await self.async_client.get(
+            reverse("polls:detail", args=[closed.id]))
+        self.assertRedirects(
+            response, reverse("polls:results", args=[closed.id]),
+            fetch_redirect_response=False)
+
+    async def test_vote_and_results(self):
+        """An async vote shows up on the async results page."""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse("polls:vote", args=[self.question.id]),
+            {"choice": self.choice.id})
+        self.assertRedirects(
+            response, reverse("polls:results", args=[self.question.id]),
+            fetch_redirect_response=False)
+        response = await self.async_client.get(
+            reverse("polls:results", args=[self.question.id]))
+        self.assertContains(response, f'<th id="votes-{self.choice.id}">1')
+        self.assertContains(response, "Your vote has been saved!")
+
+    async def test_server_timing(self):
+        """The queries of the async views are timed too."""
+        response = await self.async_client.get(
+            reverse("polls:detail", args=[self.question.id]))
+        self.assertRegex(response["Server-Timing"],
+                         r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    async def test_concurrent_server_timing(self):
+        """Concurrent requests each count their own queries only."""
+        url = reverse("polls:results", args=[self.question.id])
+
+        def queries(response):
+            return re.search(r'desc="(\d+) queries"',
+                             response["Server-Timing"]).group(1)
+        await self.async_client.get(url)
+        alone = queries(await self.async_client.get(url))
+        responses = await asyncio.gather(
+            *[self.async_client.get(url) for _ in range(10)])
+        self.assertEqual({queries(response) for response in responses},
+                         {alone})
+
+    @override_settings(POLLS_VOTE_USER_RATE=1, POLLS_VOTE_USER_BURST=1)
+    async def test_vote_throttled(self):
+        """The async vote has the same rate limits."""
+        await cache.aclear()
+        await self.async_client.aforce_login(self.user)
+        url = reverse("polls:vote", args=[self.question.id])
+        first = await self.async_client.post(url, {"choice": self.choice.id})
+        second = await self.async_client.post(url, {"choice": self.choice.id})
+        self.assertEqual([first.status_code, second.status_code], [302, 429])
+
+    async def test_not_modified(self):
+        """The async pages answer conditional requests."""
+        url = reverse("polls:results", args=[self.question.id])
+        etag = (await self.async_client.get(url))["ETag"]
+        response = await self.async_client.get(
+            url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+
+
 """Tests of user authentication.
 
    Put this file in a subdirectory of your ku-polls project,
@@ -301,6 +2341,7 @@ class UserAuthTest(django.test.TestCase):
         """superclass setUp creates
         a Client object and initializes test database"""
         super().setUp()
+        cache.clear()
         self.username = "testuser"
         self.password = "FatChance!"
         self.user1 = User.objects.create_user(
@@ -0,0 +1,234 @@
+"""Admission control of the vote endpoint.
+
+A vote is refused before the view touches the database when:
+
+* the process already has POLLS_VOTE_MAX_IN_FLIGHT votes in progress,
+  with 503 Service Unavailable, so a burst is shed instead of queueing
+  up on the database lock;
+* the user or the client address ran out of tokens in its bucket, with
+  429 Too Many Requests. The buckets live in the default cache, so they
+  are shared by the processes sharing the cache (see CACHE_BACKEND).
+  A bucket is read and written under a lock taken with cache.add(),
+  which is atomic with locmem, redis and memcached, so concurrent votes
+  cannot spend the same token. The file cache checks then writes, so
+  votes of several processes racing for a lock may all take it and
+  spend a few tokens over the burst.
+
+The address of a bucket is REMOTE_ADDR, or with POLLS_TRUSTED_PROXIES
+proxies in front of the app, the X-Forwarded-For entry added by the
+farthest of them: the entries before it are sent by the client, who
+can change them at will. The address is normalized and hashed into the
+cache key, which keeps the key short and valid on every backend.
+"""
+
+import asyncio
+import hashlib
+import ipaddress
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Votes admitted, throttled (429) and shed (503) by this process.
+COUNTERS = Counter()
+
+# Seconds a vote holds the lock of a bucket at most, and waits for it,
+# and how often it looks.
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.1
+POLL_INTERVAL = 0.001
+
+_lock = threading.Lock()
+_in_flight = 0
+
+
+def get_client_ip(request):
+    """ Retrieve ip from the user"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[0]
+    else:
+        ip = request.META.get('REMOTE_ADDR')
+    return ip
+
+
+def client_address(request) -> str:
+    """Return the address of the client of the request, trusting only
+    the X-Forwarded-For entries added by POLLS_TRUSTED_PROXIES."""
+    address = request.META.get("REMOTE_ADDR", "")
+    proxies = settings.POLLS_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [
+            entry.strip() for entry in
+            request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")
+            if entry.strip()]
+        if len(forwarded) >= proxies:
+            address = forwarded[-proxies]
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return address
+
+
+def _address_key(address: str) -> str:
+    """Return the cache key of the bucket of a client address."""
+    digest = hashlib.blake2b(address.encode(), digest_size=16).hexdigest()
+    return f"polls:bucket:ip:{digest}"
+
+
+def _count(outcome: str):
+    """Count the outcome of a vote request."""
+    with _lock:
+        COUNTERS[outcome] += 1
+
+
+def in_flight() -> int:
+    """Return the number of votes in progress in this process."""
+    return _in_flight
+
+
+def _enter() -> bool:
+    """Count a vote in progress, unless there are too many already."""
+    global _in_flight
+    limit = settings.POLLS_VOTE_MAX_IN_FLIGHT
+    with _lock:
+        if limit and _in_flight >= limit:
+            COUNTERS["shed"] += 1
+            return False
+        _in_flight += 1
+        return True
+
+
+def _leave():
+    """Count the end of a vote in progress."""
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def _buckets(request, user_id) -> list:
+    """Return the key, rate and burst of the buckets of the request,
+    leaving out the disabled ones."""
+    buckets = [(_address_key(client_address(request)),
+                settings.POLLS_VOTE_IP_RATE, settings.POLLS_VOTE_IP_BURST)]
+    if user_id is not None:
+        buckets.append((f"polls:bucket:user:{user_id}",
+                        settings.POLLS_VOTE_USER_RATE,
+                        settings.POLLS_VOTE_USER_BURST))
+    return [bucket for bucket in buckets if bucket[1] > 0]
+
+
+def _spend(state, rate: float, burst: int) -> tuple:
+    """Refill a bucket and take a token from it.
+
+    Returns:
+        the new state of the bucket, or None when it is empty, and the
+        seconds until it holds a token again
+    """
+    now = time.time()
+    tokens, updated = state or (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens < 1:
+        return None, (1 - tokens) / rate
+    return (tokens - 1, now), 0
+
+
+def take_token(key: str, rate: float, burst: int) -> float:
+    """Take a token from the bucket stored under key, holding its lock.
+
+    A vote that cannot get the lock within LOCK_WAIT is refused, as the
+    bucket is busy with other votes of the same user or address.
+
+    Returns:
+        0 when a token was taken, otherwise the seconds to wait
+    """
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return 1 / rate
+        time.sleep(POLL_INTERVAL)
+    try:
+        state, wait = _spend(cache.get(key), rate, burst)
+        if state is not None:
+            # An idle bucket is full again after burst / rate seconds.
+            cache.set(key, state, math.ceil(burst / rate))
+    finally:
+        cache.delete(f"{key}:lock")
+    return wait
+
+
+async def atake_token(key: str, rate: float, burst: int) -> float:
+    """Async version of take_token()."""
+    deadline = time.monotonic() + LOCK_WAIT
+    while not await cache.aadd(f"{key}:lock", 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return 1 / rate
+        await asyncio.sleep(POLL_INTERVAL)
+    try:
+        state, wait = _spend(await cache.aget(key), rate, burst)
+        if state is not None:
+            await cache.aset(key, state, math.ceil(burst / rate))
+    finally:
+        await cache.adelete(f"{key}:lock")
+    return wait
+
+
+def _refused(reason: str, status: int, wait: float) -> HttpResponse:
+    """Return the response refusing a vote."""
+    response = HttpResponse(f"Too many votes, try again later ({reason}).",
+                            status=status, content_type="text/plain")
+    response["Retry-After"] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def _throttled(waits) -> HttpResponse:
+    """Return the 429 response when a bucket is empty, or None."""
+    wait = max(waits, default=0)
+    if not wait:
+        _count("accepted")
+        return None
+    _count("throttled")
+    return _refused("throttled", 429, wait)
+
+
+def admission_control(view):
+    """Decorate a sync or async vote view with the in-flight limit
+    and the token buckets of the user and the client address."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if not _enter():
+                return _refused("overloaded", 503, 1)
+            try:
+                buckets = _buckets(
+                    request, await request.session.aget(SESSION_KEY))
+                refused = _throttled(
+                    [await atake_token(*bucket) for bucket in buckets])
+                if refused is not None:
+                    return refused
+                return await view(request, *args, **kwargs)
+            finally:
+                _leave()
+        return inner
+
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        if not _enter():
+            return _refused("overloaded", 503, 1)
+        try:
+            buckets = _buckets(request, request.session.get(SESSION_KEY))
+            refused = _throttled(
+                [take_token(*bucket) for bucket in buckets])
+            if refused is not None:
+                return refused
+            return view(request, *args, **kwargs)
+        finally:
+            _leave()
+    return inner
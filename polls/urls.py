@@ -1,11 +1,27 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.POLLS_ASYNC_VIEWS:
+    from . import async_views as page_views
+    index_view = page_views.AsyncIndexView
+    detail_view = page_views.AsyncDetailView
+    results_view = page_views.AsyncResultsView
+else:
+    page_views = views
+    index_view = views.IndexView
+    detail_view = views.DetailView
+    results_view = views.ResultsView
+
 app_name = "polls"
 urlpatterns = [
-    path("", views.IndexView.as_view(), name="index"),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/result/', views.ResultsView.as_view(), name='results'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
+    path("", index_view.as_view(), name="index"),
+    path('<int:pk>/', detail_view.as_view(), name='detail'),
+    path('<int:pk>/result/', results_view.as_view(), name='results'),
+    path('<int:pk>/result/stream/', views.results_stream,
+         name='results_stream'),
+    path('<int:question_id>/vote/', page_views.vote, name='vote'),
+    path('export/<str:kind>/', views.export, name='export'),
+    path('admission/', views.admission, name='admission'),
 ]
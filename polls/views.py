@@ -1,10 +1,28 @@
+from .etags import index_etag, question_etag
+from .export import (FORMATS, HEADERS, astream_export, export_queryset,
+                     parse_filters, stream_export)
+from .ingest import submit_vote
+from .live import SNAPSHOT_RETRY, tally_event, tally_stream
+from .metadata import find_choice, get_question
+from .metrics import collect, text_format
 from .models import Choice, Question, Vote
-from django.http import HttpResponse, Http404, HttpResponseRedirect
-from django.shortcuts import render, get_object_or_404, redirect
+from .pagination import keyset_paginate
+from .throttle import (COUNTERS, admission_control, get_client_ip,
+                       in_flight)
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (HttpResponse, Http404, HttpResponseBadRequest,
+                         HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.utils import timezone
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import (user_logged_in,
                                  user_login_failed,
                                  user_logged_out)
@@ -13,69 +31,146 @@ from django.dispatch import receiver
 
 import logging
 logger = logging.getLogger(__name__)
+# Per-vote info logs, sampled by POLLS_VOTE_LOG_SAMPLE_RATE.
+vote_logger = logging.getLogger("polls.votes")
 
 
+# Browsers and proxies must revalidate the pages, which then answer
+# 304 Not Modified while their ETag still matches.
+revalidate = cache_control(private=True, no_cache=True)
+
+
+@method_decorator([revalidate, condition(etag_func=index_etag)],
+                  name="dispatch")
 class IndexView(generic.ListView):
     """This class handles the index page"""
     template_name = "polls/index.html"
     context_object_name = "latest_question_list"
 
-    def get_queryset(self):
-        """Return the last five published questions.
+    def get_published(self):
+        """Return the published questions with the requested status.
             (not including those set to be published in the future)
         """
-        return Question.objects.filter(
+        published = Question.objects.with_status().filter(
             pub_date__lte=timezone.now()
-        ).order_by("-pub_date")
+        )
+        self.status = self.request.GET.get("status")
+        if self.status in Question.Status.values:
+            published = published.with_status_in(self.status)
+        else:
+            self.status = None
+        return published
 
+    def get_page_kwargs(self) -> dict:
+        """Return the size and the cursors of the requested page."""
+        return {
+            "per_page": settings.POLLS_PAGE_SIZE,
+            "after": self.request.GET.get("after"),
+            "before": self.request.GET.get("before"),
+        }
 
-class DetailView(generic.DetailView):
-    """This class handles the detail page"""
+    def get_queryset(self):
+        """Return one page of the published questions, newest first."""
+        self.page = keyset_paginate(
+            self.get_published(), **self.get_page_kwargs())
+        return self.page.object_list
+
+    def mark_voted(self, questions, voted: dict):
+        """Set the choice the user voted for on each question, for the
+        "voted" badges."""
+        for question in questions:
+            question.user_choice_id = voted.get(question.pk)
+
+    def get_context_data(self, **kwargs) -> dict:
+        user = self.request.user
+        if settings.POLLS_VOTED_BADGE and user.is_authenticated:
+            self.mark_voted(self.object_list, Vote.objects.voted_map(user))
+        _context = super().get_context_data(**kwargs)
+        _context["page"] = self.page
+        _context["status"] = self.status
+        return _context
+
+
+class QuestionPageMixin:
+    """Loads the question of a detail or results page once per request
+    from the metadata cache, with its status, its choices in a fixed
+    order and the choice the user voted for."""
     model = Question
+
+    def is_shown(self, question) -> bool:
+        """Tell whether the page shows the question."""
+        return True
+
+    def prepare(self, question):
+        """Return the cached question ready for the page, raising
+        Http404 when the page does not show it."""
+        if question is None or not self.is_shown(question):
+            raise Http404("No such poll.")
+        question.status = question.current_status()
+        return question
+
+    def mark_voted(self, question, voted: dict):
+        """Set the choice the user voted for on the question."""
+        question.user_choice_id = voted.get(question.pk)
+        return question
+
+    def get_object(self, queryset=None):
+        """Return the question, fetching it on the first call only."""
+        if getattr(self, "object", None) is None:
+            self.object = self.prepare(get_question(self.kwargs["pk"]))
+            user = self.request.user
+            if user.is_authenticated:
+                self.mark_voted(self.object, Vote.objects.voted_map(user))
+        return self.object
+
+
+@method_decorator([revalidate, condition(etag_func=question_etag)],
+                  name="dispatch")
+class DetailView(QuestionPageMixin, generic.DetailView):
+    """This class handles the detail page"""
     template_name = "polls/detail.html"
 
-    def get_queryset(self):
+    def is_shown(self, question) -> bool:
         """
         Excludes any question that aren't published yet.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        )
+        return question.pub_date <= timezone.now()
 
     def get_context_data(self, **kwargs) -> dict:
-        logger.debug("hello")
         _context = super().get_context_data(**kwargs)
-        question = self.get_object()
-        user = self.request.user
-        if not user.is_authenticated:
-            return _context
-        marked = user.vote_set.filter(
-            choice__question=question
-        )
-        logger.debug("The user is authenticated")
-        if marked:
-            _context["marked"] = marked[0].choice
+        question = self.object
+        user_choice_id = getattr(question, "user_choice_id", None)
+        for choice in question.choice_set.all():
+            if choice.pk == user_choice_id:
+                _context["marked"] = choice
         return _context
 
+    def redirect_for(self, question):
+        """Return the redirect away from a poll that is not open,
+        or None."""
+        if question.status == Question.Status.OPEN:
+            return None
+        if question.status == Question.Status.SCHEDULED:
+            return redirect(reverse("polls:index"))
+        messages.error(
+            self.request,
+            "This poll is already closed."
+        )
+        return redirect(
+            reverse(
+                "polls:results",
+                args=[question.id]
+            )
+        )
+
     def dispatch(self, request, *args, **kwargs) -> HttpResponse:
         """
         This method redirects the user if the polls does not exist.
         """
         try:
-            question = self.get_object()
-            if (not question.can_vote()):
-                if (not question.is_published()):
-                    return redirect(reverse("polls:index"))
-                messages.error(
-                    request,
-                    "This poll is already closed."
-                )
-                return redirect(
-                    reverse(
-                        "polls:results",
-                        args=[question.id]
-                    )
-                )
+            redirection = self.redirect_for(self.get_object())
+            if redirection is not None:
+                return redirection
             return super().dispatch(
                 request,
                 *args,
@@ -87,23 +182,50 @@ class DetailView(generic.DetailView):
             )
 
 
-class ResultsView(generic.DetailView):
+@method_decorator([revalidate, condition(etag_func=question_etag)],
+                  name="dispatch")
+class ResultsView(QuestionPageMixin, generic.DetailView):
     """This class handles the detail page"""
-    model = Question
     template_name = "polls/results.html"
 
+    def get_context_data(self, **kwargs) -> dict:
+        _context = super().get_context_data(**kwargs)
+        # The tallies are read inside the cached results table,
+        # so a cache hit never queries them.
+        _context["choices"] = Choice.objects.filter(
+            question_id=self.object.pk).order_by("pk")
+        if self.object.status == Question.Status.CLOSED:
+            # The tallies of a closed poll never change again.
+            _context["results_cache_timeout"] = None
+        else:
+            _context["results_cache_timeout"] = (
+                settings.POLLS_RESULTS_CACHE_TIMEOUT)
+        # Only an ASGI worker can hold the stream of the live tallies
+        # open; under WSGI the page keeps the tallies it was served with.
+        _context["live_results"] = (
+            isinstance(self.request, ASGIRequest)
+            and self.object.status != Question.Status.CLOSED)
+        return _context
+
+    def redirect_for(self, question):
+        """Return the redirect away from a poll that is not published
+        yet, or None."""
+        if question.status == Question.Status.SCHEDULED:
+            return redirect(
+                reverse(
+                    "polls:index"
+                )
+            )
+        return None
+
     def dispatch(self, request, *args, **kwargs) -> HttpResponse:
         """
         This method redirects the user if the polls does not exists.
         """
         try:
-            question = self.get_object()
-            if (not question.is_published()):
-                return redirect(
-                    reverse(
-                        "polls:index"
-                    )
-                )
+            redirection = self.redirect_for(self.get_object())
+            if redirection is not None:
+                return redirection
             return super().dispatch(
                 request,
                 *args,
@@ -113,22 +235,85 @@ class ResultsView(generic.DetailView):
             return redirect(reverse("polls:index"))
 
 
+async def results_stream(request, pk):
+    """Stream the tally changes of a poll as server-sent events.
+
+    Under ASGI the stream stays open and pushes every change. A WSGI
+    worker cannot hold the connection, so it sends the current tallies
+    once and has the browser reconnect only after SNAPSHOT_RETRY.
+    """
+    if not await Question.objects.filter(pk=pk).aexists():
+        raise Http404("No such poll.")
+    if isinstance(request, ASGIRequest):
+        events = tally_stream(pk)
+    else:
+        tallies = {
+            choice_id: votes async for choice_id, votes in
+            Choice.objects.filter(question_id=pk).values_list("pk", "votes")
+        }
+        events = [f"retry: {SNAPSHOT_RETRY}\n\n", tally_event(tallies)]
+    response = StreamingHttpResponse(
+        events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@staff_member_required
+def export(request, kind):
+    """Stream the votes or the per-choice results as CSV, or as NDJSON
+    with ?format=ndjson, optionally filtered by question and by the
+    publication date of the questions."""
+    fmt = request.GET.get("format", "csv")
+    if kind not in HEADERS or fmt not in FORMATS:
+        raise Http404("No such export.")
+    try:
+        filters = parse_filters(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid export filter.")
+    rows = export_queryset(kind, **filters)
+    # Under ASGI a sync iterator would be read whole before sending.
+    stream = (astream_export if isinstance(request, ASGIRequest)
+              else stream_export)
+    response = StreamingHttpResponse(
+        stream(rows, kind, fmt), content_type=FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+@staff_member_required
+def metrics(request):
+    """Return the request metrics of all the processes in the
+    Prometheus text format."""
+    return HttpResponse(
+        text_format(collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@staff_member_required
+def admission(request):
+    """Return the admission counters of the vote endpoint in this
+    process, as JSON."""
+    return JsonResponse({**COUNTERS, "in_flight": in_flight()})
+
+
+@admission_control
 def vote(request, question_id):
-    logger.info("Vote submitted for poll #{0}".format(question_id))
     """This function handles the POST request
     from the using voting on the poll"""
-    question = get_object_or_404(Question, pk=question_id)
+    vote_logger.info("Vote submitted for poll #%s", question_id)
+    question = get_question(question_id)
+    if question is None:
+        raise Http404("No such poll.")
     try:
-        selected_choice = question.choice_set.get(
-            pk=request.POST["choice"]
-        )
-        logger.info(
-            f"Question {question_id} vote for choice {request.POST['choice']}"
-        )
+        selected_choice = find_choice(question, request.POST["choice"])
+        vote_logger.info("Question %s vote for choice %s",
+                         question_id, request.POST["choice"])
     except (KeyError, Choice.DoesNotExist):
         logger.error(
-            "The choice has not been selected for the question {0}."
-            .format(question_id))
+            "The choice has not been selected for the question %s.",
+            question_id)
         messages.error(
             request,
             "You didn't select a choice. Please consider doing so.")
@@ -149,19 +334,7 @@ def vote(request, question_id):
         return HttpResponseRedirect(
             f"{redirect_url}?next={next_url}"
         )
-    try:
-        # When the user already vote for this option
-        vote = this_user.vote_set.get(
-            choice__question=question
-        )
-        vote.choice = selected_choice
-    except Vote.DoesNotExist:
-        vote = Vote.objects.create(
-            user=this_user,
-            choice=selected_choice
-        )
-
-    vote.save()
+    submit_vote(this_user, selected_choice)
     # Always return a redirect after a POST request. :D
     messages.success(
         request,
@@ -175,33 +348,24 @@ def vote(request, question_id):
     )
 
 
-def get_client_ip(request):
-    """ Retrieve ip from the user"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
-
-
 @receiver(user_logged_in)
 def user_logged_in_successfully(sender, request, user, **kwargs):
     """Log the user loggin in"""
     ip_addr = get_client_ip(request)
-    logger.info(f'{user.username} logged in at the ip address: {ip_addr}')
+    logger.info("%s logged in at the ip address: %s", user.username, ip_addr)
 
 
 @receiver(user_logged_out)
 def user_logged_out_successfully(sender, request, user, **kwargs):
     """Log the user loggin in"""
     ip_addr = get_client_ip(request)
-    logger.info(f'{user.username} logged out at the ip address: {ip_addr}')
+    logger.info("%s logged out at the ip address: %s",
+                user.username, ip_addr)
 
 
 @receiver(user_login_failed)
 def user_logged_in_failed(sender, request, credentials, **kwargs):
     """Log the user loggin in"""
     ip_addr = get_client_ip(request)
-    logger.warning(
-        f'{credentials["username"]} from {ip_addr} tried to login but failed.')
+    logger.warning("%s from %s tried to login but failed.",
+                   credentials["username"], ip_addr)